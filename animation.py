@@ -0,0 +1,116 @@
+import asyncio
+import dataclasses
+import logging
+import time
+
+import aiohttp
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+# The old per-message loop edited every 0.1 s; used to count edits saved.
+LEGACY_EDIT_INTERVAL = 0.1
+
+
+@dataclasses.dataclass()
+class Animation:
+    chat_id: int
+    message_id: int
+    text: str
+    started_at: float
+    frame: int = 0
+    edits: int = 0
+
+
+class AnimationScheduler:
+    """Drives every loading animation from a single loop with global and per-chat edit limits."""
+
+    STATES = [1, 2, 3, 2]
+
+    def __init__(self, bot: Bot, tick: float, chat_interval: float, global_rate: float, max_duration: float) -> None:
+        self.bot = bot
+        self.tick = tick
+        self.chat_interval = chat_interval
+        self.global_rate = global_rate
+        self.max_duration = max_duration
+        self.edits_sent = 0
+        self.edits_skipped = 0
+        self.edits_saved = 0
+        self._animations: dict[tuple[int, int], Animation] = {}
+        self._last_edit: dict[int, float] = {}
+        self._paused_until = 0.0
+        self._task: asyncio.Task | None = None
+
+    def start(self, chat_id: int, message_id: int, text: str) -> None:
+        """Start animating a loading message."""
+        self._animations[(chat_id, message_id)] = Animation(chat_id, message_id, text, time.monotonic())
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self, chat_id: int, message_id: int) -> None:
+        """Stop animating a loading message; safe to call more than once."""
+        animation = self._animations.pop((chat_id, message_id), None)
+        if animation is None:
+            return
+        elapsed = time.monotonic() - animation.started_at
+        self.edits_saved += max(int(elapsed / LEGACY_EDIT_INTERVAL) - animation.edits, 0)
+        if not any(key[0] == chat_id for key in self._animations):
+            self._last_edit.pop(chat_id, None)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "active": len(self._animations),
+            "edits_sent": self.edits_sent,
+            "edits_skipped": self.edits_skipped,
+            "edits_saved": self.edits_saved,
+        }
+
+    async def _run(self) -> None:
+        while self._animations:
+            await asyncio.sleep(self.tick)
+            try:
+                await self._step()
+            except Exception:
+                # One bad tick must not freeze every animation.
+                logger.exception("Animation tick failed")
+
+    async def _step(self) -> None:
+        now = time.monotonic()
+        if now < self._paused_until:
+            self.edits_skipped += len(self._animations)
+            return
+        budget = max(int(self.global_rate * self.tick), 1)
+        batch = []
+        # Chats that waited longest go first, so the global budget is shared fairly.
+        for animation in sorted(self._animations.values(), key=lambda a: self._last_edit.get(a.chat_id, 0.0)):
+            if now - animation.started_at > self.max_duration:
+                self.stop(animation.chat_id, animation.message_id)
+            elif budget <= 0 or now - self._last_edit.get(animation.chat_id, 0.0) < self.chat_interval:
+                self.edits_skipped += 1
+            else:
+                budget -= 1
+                self._last_edit[animation.chat_id] = now
+                batch.append(animation)
+        results = await asyncio.gather(*(self._edit(animation) for animation in batch), return_exceptions=True)
+        for animation, result in zip(batch, results):
+            if isinstance(result, Exception):
+                logger.error("Animation in chat %s failed: %s", animation.chat_id, result)
+                self.stop(animation.chat_id, animation.message_id)
+
+    async def _edit(self, animation: Animation) -> None:
+        animation.frame += 1
+        text = f"{animation.text}{' ' * self.STATES[animation.frame % len(self.STATES)]}\U0001F50D"
+        try:
+            await self.bot.edit_message_text(text=text, chat_id=animation.chat_id, message_id=animation.message_id)
+            animation.edits += 1
+            self.edits_sent += 1
+        except TelegramRetryAfter as e:
+            logger.warning("Flood control, animations paused for %s s", e.retry_after)
+            self._paused_until = time.monotonic() + e.retry_after
+        except TelegramBadRequest:
+            self.stop(animation.chat_id, animation.message_id)
+        except (TelegramAPIError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # Blocked bot, network or server errors: give up on this animation only.
+            logger.warning("Animation in chat %s stopped: %s", animation.chat_id, e)
+            self.stop(animation.chat_id, animation.message_id)
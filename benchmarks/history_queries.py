@@ -0,0 +1,100 @@
+"""Benchmark of the per-user history and watch-later queries as the tables grow.
+
+Builds throwaway SQLite databases with the schema before (version 1) and
+after (latest) the index migration and times the page queries db.py runs:
+the first page, and a page from the middle of the list reached with a cursor.
+
+    python -m benchmarks.history_queries [rows ...]
+"""
+import datetime
+import pathlib
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+import db
+
+USERS = 10_000
+SAMPLES = 200
+
+
+def _middle(connection: sqlite3.Connection, query: str) -> tuple | None:
+    rows = connection.execute(query).fetchall()
+    return rows[len(rows) // 2] if rows else None
+
+
+def history_first(connection: sqlite3.Connection, user_id: int) -> str:
+    return str(db.history_page_query(user_id, None, db.PAGE_SIZE))
+
+
+def history_middle(connection: sqlite3.Connection, user_id: int) -> str:
+    row = _middle(connection, f"SELECT request_time, id FROM history WHERE user_id = {user_id} ORDER BY request_time, id")
+    return str(db.history_page_query(user_id, f"{row[0]}|{row[1]}" if row else None, db.PAGE_SIZE))
+
+
+def watch_later_first(connection: sqlite3.Connection, user_id: int) -> str:
+    return str(db.watch_later_page_query(user_id, None, db.PAGE_SIZE))
+
+
+def watch_later_middle(connection: sqlite3.Connection, user_id: int) -> str:
+    row = _middle(connection, f"SELECT id FROM watch_later WHERE user_id = {user_id} ORDER BY id")
+    return str(db.watch_later_page_query(user_id, row[0] if row else None, db.PAGE_SIZE))
+
+
+QUERIES = {
+    "history": history_first,
+    "history+cursor": history_middle,
+    "watch_later": watch_later_first,
+    "watch_later+cursor": watch_later_middle,
+}
+
+
+def build(path: pathlib.Path, rows: int, version: int) -> sqlite3.Connection:
+    connection = sqlite3.connect(path)
+    for target, statements in db.MIGRATIONS["sqlite"]:
+        if target <= version:
+            for statement in statements:
+                connection.execute(statement)
+    start = datetime.datetime(2024, 1, 1)
+    history_rows = (
+        (random.randrange(USERS), f"Film {i}", 1950 + i % 75, (start + datetime.timedelta(seconds=i)).isoformat())
+        for i in range(rows)
+    )
+    connection.executemany(
+        "INSERT INTO history (user_id, name, year, request_time) VALUES (?, ?, ?, ?)", history_rows
+    )
+    connection.executemany(
+        "INSERT OR IGNORE INTO watch_later (user_id, name, year) VALUES (?, ?, ?)",
+        ((random.randrange(USERS), f"Film {i}", 1950 + i % 75) for i in range(rows // 10)),
+    )
+    connection.commit()
+    return connection
+
+
+def measure(connection: sqlite3.Connection, make_query) -> float:
+    # Cursors are looked up before the clock starts; only the page queries are timed.
+    queries = [make_query(connection, random.randrange(USERS)) for _ in range(SAMPLES)]
+    started = time.perf_counter()
+    for query in queries:
+        connection.execute(query).fetchall()
+    return (time.perf_counter() - started) / SAMPLES * 1000
+
+
+def main(sizes: list[int]) -> None:
+    random.seed(0)
+    versions = {"no index": 1, "indexed": db.MIGRATIONS["sqlite"][-1][0]}
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in sizes:
+            for label, version in versions.items():
+                connection = build(pathlib.Path(directory) / f"{rows}-{version}.db", rows, version)
+                timings = "   ".join(
+                    f"{name} {measure(connection, make_query):8.3f} ms" for name, make_query in QUERIES.items()
+                )
+                print(f"{rows:>10,} rows  {label:<9} {timings}")
+                connection.close()
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000])
@@ -0,0 +1,318 @@
+"""Offline load test of the bot handlers and web routes against local upstream stubs.
+
+Starts aiohttp servers standing in for Kinopoisk, Google, Zona and the Telegram
+Bot API (with configurable latency and failure rate), points the project at them
+through KINOPOISK_URL, GOOGLE_URL, ZONA_URL and TELEGRAM_API_URL, and drives
+search and /random updates through the dispatcher and the Quart routes at a
+fixed concurrency. Reports throughput and p50/p99 latency per scenario.
+
+    python -m benchmarks.load [--requests N] [--concurrency C] [--latency MS] [--failure-rate P]
+                              [--save report.json] [--compare baseline.json] [--tolerance 0.2]
+
+With --compare the exit status is 1 if any scenario's p99 latency grew or its
+throughput dropped by more than the tolerance. The Kinopoisk rate limit is lifted
+unless KINOPOISK_RATE is set, and Google results point to https:// links on the
+plain-HTTP stub, so HEAD checks fail fast and no LordFilm link is found.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import socket
+import statistics
+import sys
+import tempfile
+import time
+import typing as tp
+
+from aiohttp import web
+
+TITLES = 200
+USERS = 50
+
+
+def film_page(i: int, base: str) -> dict[str, tp.Any]:
+    return {
+        "id": 1000 + i,
+        "name": f"Фильм {i}",
+        "alternativeName": f"Film {i}",
+        "year": 1950 + i % 75,
+        "rating": {"kp": 7.0 + i % 30 / 10},
+        "votes": {"kp": 10_000 + i},
+        "description": "Описание фильма " * 20,
+        "poster": {"url": f"{base}/posters/{i}.jpg"},
+    }
+
+
+# ---------UPSTREAM STUBS----------
+def _listen() -> socket.socket:
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    return sock
+
+
+def _base(sock: socket.socket) -> str:
+    return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+def upstream_app(base: str, latency: float, failure_rate: float) -> web.Application:
+    """Kinopoisk API, Google and Zona search on one server."""
+
+    @web.middleware
+    async def delay(request: web.Request, handler: tp.Callable) -> web.StreamResponse:
+        await asyncio.sleep(latency * random.uniform(0.5, 1.5))
+        if random.random() < failure_rate:
+            return web.Response(status=503)
+        return await handler(request)
+
+    async def kinopoisk_random(_: web.Request) -> web.Response:
+        return web.json_response(film_page(random.randrange(TITLES), base))
+
+    async def kinopoisk_search(request: web.Request) -> web.Response:
+        query = request.query.get("query", "").casefold()
+        limit = int(request.query.get("limit", 10))
+        pages = (film_page(i, base) for i in range(TITLES))
+        docs = [page for page in pages if page["name"].casefold().startswith(query)][:limit]
+        return web.json_response({"docs": docs, "total": len(docs)})
+
+    async def google(request: web.Request) -> web.Response:
+        slug = request.query.get("q", "").replace(" ", "-")
+        links = "".join(
+            f'<div><a jsname="UWckNb" href="https://127.0.0.1:{request.url.port}/lordfilm/{slug}-{i}">{i}</a></div>'
+            for i in range(3)
+        )
+        return web.Response(text=f"<html><body>{links}</body></html>", content_type="text/html")
+
+    async def zona(request: web.Request) -> web.Response:
+        name = request.match_info["name"].strip()
+        i = int(name.rsplit(" ", 1)[-1]) if name.rsplit(" ", 1)[-1].isdigit() else 0
+        item = (
+            f'<div class="results-item-wrap"><a href="/movies/film-{i}">{name}</a>'
+            f'<span class="results-item-year">{1950 + i % 75}</span></div>'
+        )
+        return web.Response(text=f"<html><body>{item}</body></html>", content_type="text/html")
+
+    app = web.Application(middlewares=[delay])
+    app.router.add_get("/kinopoisk/movie/random", kinopoisk_random)
+    app.router.add_get("/kinopoisk/movie/search", kinopoisk_search)
+    app.router.add_get("/search", google)
+    app.router.add_get("/zona/search/{name}", zona)
+    return app
+
+
+def telegram_app(latency: float) -> web.Application:
+    """Bot API answering every send/edit with a message and everything else with True."""
+    message_ids = itertools.count(1)
+
+    async def call(request: web.Request) -> web.Response:
+        await asyncio.sleep(latency * random.uniform(0.5, 1.5))
+        method = request.match_info["method"].casefold()
+        data = await request.post()
+        result: tp.Any = True
+        if method.startswith(("send", "edit")):
+            result = {
+                "message_id": next(message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(data.get("chat_id", 0)), "type": "private"},
+            }
+        return web.json_response({"ok": True, "result": result})
+
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", call)
+    return app
+
+
+async def start(app: web.Application, sock: socket.socket) -> web.AppRunner:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.SockSite(runner, sock).start()
+    return runner
+
+
+# ---------LOAD----------
+async def run_scenario(
+        call: tp.Callable[[int], tp.Awaitable[bool]], requests: int, concurrency: int
+) -> dict[str, float]:
+    """Run `requests` calls, `concurrency` at a time; a call returns False (or raises) on failure."""
+    latencies: list[float] = []
+    errors = 0
+    indices = iter(range(requests))
+
+    async def worker() -> None:
+        nonlocal errors
+        for i in indices:
+            started = time.perf_counter()
+            try:
+                ok = await call(i)
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            errors += not ok
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "requests": requests,
+        "errors": errors,
+        "rps": requests / elapsed,
+        "p50_ms": percentiles[49] * 1000,
+        "p99_ms": percentiles[98] * 1000,
+    }
+
+
+def bot_scenarios() -> dict[str, tp.Callable[[int], tp.Awaitable[bool]]]:
+    import metrics
+    import telegram_bot
+
+    update_ids = itertools.count(1)
+
+    def feed(
+            handler: str, text: tp.Callable[[int], str], users: int = USERS
+    ) -> tp.Callable[[int], tp.Awaitable[bool]]:
+        async def call(i: int) -> bool:
+            user = {"id": 1 + i % users, "is_bot": False, "first_name": "bench"}
+            update = {
+                "update_id": next(update_ids),
+                "message": {
+                    "message_id": i + 1,
+                    "date": int(time.time()),
+                    "chat": {"id": user["id"], "type": "private"},
+                    "from": user,
+                    "text": text(i),
+                },
+            }
+            # Command handlers report their own failures instead of raising; under concurrency
+            # a failure may be attributed to a neighbouring call, the total stays right.
+            failed = metrics.HANDLER_ERRORS.value(handler=handler)
+            await telegram_bot.dp.feed_raw_update(telegram_bot.bot, update)
+            return metrics.HANDLER_ERRORS.value(handler=handler) == failed
+
+        return call
+
+    return {
+        "bot search": feed("search_handler", lambda i: f"Фильм {random.randrange(TITLES)}"),
+        "bot /random": feed("random_handler", lambda i: "/random"),
+        # One user sending messages faster than they are answered: superseded searches are shed.
+        "bot search flood": feed("search_handler", lambda i: f"Фильм {random.randrange(TITLES)}", users=1),
+    }
+
+
+def web_scenarios(client: tp.Any) -> dict[str, tp.Callable[[int], tp.Awaitable[bool]]]:
+    def get(path: str, query: tp.Callable[[int], dict[str, str]] = lambda i: {}) -> tp.Callable[[int], tp.Awaitable[bool]]:
+        async def call(i: int) -> bool:
+            response = await client.get(path, query_string=query(i))
+            await response.get_data()
+            return response.status_code == 200
+
+        return call
+
+    return {
+        "web /search": get("/search", lambda i: {"query": f"Фильм {random.randrange(TITLES)}"}),
+        "web /api/search": get("/api/search", lambda i: {"query": f"Фильм {random.randrange(TITLES // 10)}"}),
+        "web /history": get("/history"),
+        "web /watch_later": get("/watch_later"),
+    }
+
+
+async def run(args: argparse.Namespace) -> dict[str, dict[str, float]]:
+    upstream_sock, telegram_sock = _listen(), _listen()
+    upstream, telegram = _base(upstream_sock), _base(telegram_sock)
+    directory = tempfile.TemporaryDirectory()
+    os.environ.update({
+        "KINOPOISK_URL": f"{upstream}/kinopoisk",
+        "GOOGLE_URL": upstream,
+        "ZONA_URL": f"{upstream}/zona",
+        "TELEGRAM_API_URL": telegram,
+        "DATABASE_URL": os.path.join(directory.name, "bench.db"),
+        "BOT_TOKEN": "123456:bench",
+        "TOKEN_KINOPOISK": os.environ.get("TOKEN_KINOPOISK") or "bench",
+        "METRICS_PORT": "0",
+        "SECRET_KEY": os.environ.get("SECRET_KEY") or "bench",
+    })
+    os.environ.setdefault("KINOPOISK_RATE", "100000")
+    os.environ.setdefault("KINOPOISK_BURST", "100000")
+    runners = [
+        await start(upstream_app(upstream, args.latency / 1000, args.failure_rate), upstream_sock),
+        await start(telegram_app(args.telegram_latency / 1000), telegram_sock),
+    ]
+    # Project modules read their configuration on import, so they are imported only now.
+    import logs
+    import quart_auth
+    import telegram_bot
+    import web_app
+
+    # Set up here, before the web app's startup does it with LOG_LEVEL.
+    logs.setup_logging(level="INFO" if args.verbose else "CRITICAL")
+
+    report = {}
+    try:
+        await telegram_bot.on_startup(metrics_port=0)
+        try:
+            for name, call in bot_scenarios().items():
+                report[name] = await run_scenario(call, args.requests, args.concurrency)
+        finally:
+            await telegram_bot.on_shutdown()
+            await telegram_bot.bot.session.close()
+        async with web_app.app.test_app() as app:
+            client = app.test_client()
+            async with quart_auth.authenticated_client(client, "1"):
+                for name, call in web_scenarios(client).items():
+                    report[name] = await run_scenario(call, args.requests, args.concurrency)
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+        directory.cleanup()
+    return report
+
+
+def regressions(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    found = []
+    for name, stats in report.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if stats["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+            found.append(f"{name}: p99 {base['p99_ms']:.1f} -> {stats['p99_ms']:.1f} ms")
+        if stats["rps"] < base["rps"] * (1 - tolerance):
+            found.append(f"{name}: {base['rps']:.1f} -> {stats['rps']:.1f} req/s")
+    return found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=50, help="mean upstream latency, ms")
+    parser.add_argument("--telegram-latency", type=float, default=20, help="mean Bot API latency, ms")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of upstream calls answering 503")
+    parser.add_argument("--save", help="write the report as JSON")
+    parser.add_argument("--compare", help="baseline report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--verbose", action="store_true", help="keep the project's log output")
+    args = parser.parse_args()
+
+    random.seed(0)
+    report = asyncio.run(run(args))
+    print(f"{'scenario':<18} {'requests':>8} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, stats in report.items():
+        print(
+            f"{name:<18} {stats['requests']:>8} {stats['errors']:>6} {stats['rps']:>8.1f} "
+            f"{stats['p50_ms']:>8.1f} {stats['p99_ms']:>8.1f}"
+        )
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            found = regressions(report, json.load(file), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}")
+        sys.exit(1 if found else 0)
+
+
+if __name__ == "__main__":
+    main()
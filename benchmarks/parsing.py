@@ -0,0 +1,75 @@
+"""Micro-benchmark of the scraper parsers over fixture result pages.
+
+Compares the old full-tree parse with the SoupStrainer-limited parsers used
+in utils, for every available parser backend. The fixtures reproduce the
+markup of Google and Zona search results padded with unrelated page content.
+
+    python -m benchmarks.parsing [repeat]
+"""
+import pathlib
+import sys
+import timeit
+
+from bs4 import BeautifulSoup
+
+import utils
+
+FIXTURES = pathlib.Path(__file__).parent / "fixtures"
+
+
+def full_google(text: str, parser: str) -> list[str]:
+    soup = BeautifulSoup(text, parser)
+    return [item.get("href") for item in soup.find_all(attrs={"jsname": "UWckNb"})[:3]]
+
+
+def full_zona(text: str, parser: str) -> list[tuple[str, str]]:
+    soup = BeautifulSoup(text, parser)
+    return [
+        (item.find(attrs={"class": "results-item-year"}).text, item.find("a").get("href"))
+        for item in soup.find_all(attrs={"class": "results-item-wrap"})
+    ]
+
+
+def strained_google(text: str, parser: str) -> list[str]:
+    soup = BeautifulSoup(text, parser, parse_only=utils.GOOGLE_RESULTS)
+    return [item.get("href") for item in soup.find_all(attrs={"jsname": "UWckNb"})[:3]]
+
+
+def strained_zona(text: str, parser: str) -> list[tuple[str, str]]:
+    soup = BeautifulSoup(text, parser, parse_only=utils.ZONA_RESULTS)
+    return [
+        (item.find(attrs={"class": "results-item-year"}).text, item.find("a").get("href"))
+        for item in soup.find_all(class_=utils._has_class("results-item-wrap"))
+    ]
+
+
+def available_parsers() -> list[str]:
+    parsers = ["html.parser"]
+    try:
+        import lxml  # noqa: F401
+        parsers.append("lxml")
+    except ImportError:
+        pass
+    return parsers
+
+
+def main(repeat: int = 20) -> None:
+    pages = {
+        "google": (FIXTURES / "google_search.html").read_text(encoding="utf-8"),
+        "zona": (FIXTURES / "zona_search.html").read_text(encoding="utf-8"),
+    }
+    cases = {"google": (full_google, strained_google), "zona": (full_zona, strained_zona)}
+    for parser in available_parsers():
+        for page, (full, strained) in cases.items():
+            text = pages[page]
+            assert full(text, parser) == strained(text, parser), f"{page}/{parser}: results differ"
+            full_time = timeit.timeit(lambda: full(text, parser), number=repeat) / repeat
+            strained_time = timeit.timeit(lambda: strained(text, parser), number=repeat) / repeat
+            print(
+                f"{page:<7} {parser:<12} full {full_time * 1000:8.2f} ms   "
+                f"strained {strained_time * 1000:8.2f} ms   x{full_time / strained_time:.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -0,0 +1,50 @@
+import collections
+import time
+import typing as tp
+
+# Sentinel returned by TTLCache.get on a miss, so that None can be cached
+# as a negative ("not found") entry.
+MISSING = object()
+
+
+class TTLCache:
+    """In-memory LRU cache whose entries expire after a TTL."""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: collections.OrderedDict[tp.Hashable, tuple[float, tp.Any]] = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: tp.Hashable, default: tp.Any = MISSING) -> tp.Any:
+        """Return a live entry and mark it as recently used."""
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: tp.Hashable, value: tp.Any, ttl: float | None = None) -> None:
+        """Store an entry, evicting the least recently used one when full."""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: tp.Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
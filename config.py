@@ -4,8 +4,100 @@ import os
 load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.1))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
 DB_PATH = os.getenv("DATABASE_URL")
+DB_READERS = int(os.getenv("DB_READERS", 4))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", 200))
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", 0.01))
+HISTORY_QUEUE_SIZE = int(os.getenv("HISTORY_QUEUE_SIZE", 5000))
+# Longest a history read waits for this process's queued rows to be written.
+HISTORY_FLUSH_TIMEOUT = float(os.getenv("HISTORY_FLUSH_TIMEOUT", 5))
+HISTORY_RETENTION = int(os.getenv("HISTORY_RETENTION", 1000))
+HISTORY_ARCHIVE_INTERVAL = float(os.getenv("HISTORY_ARCHIVE_INTERVAL", 60 * 60))
+# Most history rows moved to the archive in one transaction.
+HISTORY_ARCHIVE_BATCH = int(os.getenv("HISTORY_ARCHIVE_BATCH", 500))
+# The bot archives history; set for deployments that run the web app without the bot.
+WEB_ARCHIVE_HISTORY = os.getenv("WEB_ARCHIVE_HISTORY", "0") == "1"
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", 10))
 TOKEN_KINOPOISK = os.getenv("TOKEN_KINOPOISK")
+# Upstream base URLs; overridden to point at local stubs in benchmarks.
+KINOPOISK_URL = os.getenv("KINOPOISK_URL", "https://api.kinopoisk.dev/v1.4")
+GOOGLE_URL = os.getenv("GOOGLE_URL", "https://www.google.com")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+# Several keys may be given separated by commas; requests rotate across them.
+TOKENS_KINOPOISK = [token.strip() for token in (TOKEN_KINOPOISK or "").split(",") if token.strip()]
+KINOPOISK_RATE = float(os.getenv("KINOPOISK_RATE", 5))
+KINOPOISK_BURST = int(os.getenv("KINOPOISK_BURST", 10))
+KINOPOISK_DAILY_LIMIT = int(os.getenv("KINOPOISK_DAILY_LIMIT", 0))
+KINOPOISK_KEY_COOLDOWN = float(os.getenv("KINOPOISK_KEY_COOLDOWN", 60))
+HTTP_LIMIT = int(os.getenv("HTTP_LIMIT", 200))
+HTTP_LIMIT_PER_HOST = int(os.getenv("HTTP_LIMIT_PER_HOST", 30))
+HTTP_DNS_TTL = int(os.getenv("HTTP_DNS_TTL", 300))
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", 30))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 10))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 3))
+FILM_CACHE_SIZE = int(os.getenv("FILM_CACHE_SIZE", 2048))
+FILM_CACHE_TTL = float(os.getenv("FILM_CACHE_TTL", 24 * 60 * 60))
+FILM_CACHE_NEGATIVE_TTL = float(os.getenv("FILM_CACHE_NEGATIVE_TTL", 10 * 60))
+FILM_CACHE_PERSISTENT = os.getenv("FILM_CACHE_PERSISTENT", "0") == "1"
+POSTER_CACHE_SIZE = int(os.getenv("POSTER_CACHE_SIZE", 4096))
+POSTER_CACHE_TTL = float(os.getenv("POSTER_CACHE_TTL", 24 * 60 * 60))
+POSTER_DIR = os.getenv("POSTER_DIR", "posters")
+POSTER_WIDTH = int(os.getenv("POSTER_WIDTH", 400))
+POSTER_MAX_AGE = int(os.getenv("POSTER_MAX_AGE", 30 * 24 * 60 * 60))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 1024))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", 10 * 60))
+GZIP_MIN_SIZE = int(os.getenv("GZIP_MIN_SIZE", 500))
+SUGGEST_LIMIT = int(os.getenv("SUGGEST_LIMIT", 10))
+SUGGEST_INDEX_SIZE = int(os.getenv("SUGGEST_INDEX_SIZE", 20000))
+SUGGEST_MIN_QUERY = int(os.getenv("SUGGEST_MIN_QUERY", 3))
+# Catalog of every film seen: searches matching one of its titles are answered without Kinopoisk.
+CATALOG_ENABLED = os.getenv("CATALOG_ENABLED", "1") == "1"
+CATALOG_CANDIDATES = int(os.getenv("CATALOG_CANDIDATES", 50))
+CATALOG_WARM_SIZE = int(os.getenv("CATALOG_WARM_SIZE", 5000))
 ZONA_URL = os.getenv("ZONA_URL")
+LINKS_TTL = float(os.getenv("LINKS_TTL", 24 * 60 * 60))
+LINKS_NEGATIVE_TTL = float(os.getenv("LINKS_NEGATIVE_TTL", 60 * 60))
+LINKS_DEADLINE = float(os.getenv("LINKS_DEADLINE", 3.0))
+PROVIDER_CONCURRENCY = int(os.getenv("PROVIDER_CONCURRENCY", 20))
+PROVIDER_TIMEOUT = float(os.getenv("PROVIDER_TIMEOUT", 1.0))
+PROVIDER_MIN_TIMEOUT = float(os.getenv("PROVIDER_MIN_TIMEOUT", 0.5))
+PROVIDER_MAX_TIMEOUT = float(os.getenv("PROVIDER_MAX_TIMEOUT", 2.5))
+PROVIDER_RETRIES = int(os.getenv("PROVIDER_RETRIES", 1))
+PROVIDER_FAILURE_THRESHOLD = int(os.getenv("PROVIDER_FAILURE_THRESHOLD", 5))
+PROVIDER_RESET_TIMEOUT = float(os.getenv("PROVIDER_RESET_TIMEOUT", 30))
+# Searches run at once across all users, per user, and users allowed to wait for a slot.
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", 20))
+SEARCH_PER_USER = int(os.getenv("SEARCH_PER_USER", 1))
+SEARCH_QUEUE_SIZE = int(os.getenv("SEARCH_QUEUE_SIZE", 200))
+ANIMATION_TICK = float(os.getenv("ANIMATION_TICK", 0.5))
+ANIMATION_CHAT_INTERVAL = float(os.getenv("ANIMATION_CHAT_INTERVAL", 1.0))
+ANIMATION_GLOBAL_RATE = float(os.getenv("ANIMATION_GLOBAL_RATE", 20))
+ANIMATION_MAX_DURATION = float(os.getenv("ANIMATION_MAX_DURATION", 10))
+PROGRESSIVE_REPLY = os.getenv("PROGRESSIVE_REPLY", "1") == "1"
+PROGRESSIVE_GRACE = float(os.getenv("PROGRESSIVE_GRACE", 0.1))
+# "thread" or "process"; daemon processes such as webhook workers always parse in threads.
+PARSER_EXECUTOR = os.getenv("PARSER_EXECUTOR", "thread")
+PARSER_WORKERS = int(os.getenv("PARSER_WORKERS", 2))
+RANDOM_POOL_SIZE = int(os.getenv("RANDOM_POOL_SIZE", 10))
+RANDOM_POOL_CONCURRENCY = int(os.getenv("RANDOM_POOL_CONCURRENCY", 2))
+RANDOM_POOL_MAX_AGE = float(os.getenv("RANDOM_POOL_MAX_AGE", 60 * 60))
 SECRET_KEY = os.getenv("SECRET_KEY")
 DOMAIN = "https://true-buckets-shop.loca.lt"
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", DOMAIN)
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+# Secret Telegram sends with every update; a random one is generated on start when unset.
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Port of the /metrics endpoint of bot processes (0 disables it). Under the webhook the front uses METRICS_PORT
+# and worker i uses METRICS_PORT + 1 + i.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+# Port of the web app's /metrics endpoint on METRICS_HOST (0 disables it).
+WEB_METRICS_PORT = int(os.getenv("WEB_METRICS_PORT", 0))
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", os.cpu_count() or 1))
@@ -1,122 +1,712 @@
+import asyncio
+import collections
 import datetime
-import aiosqlite
-from pypika import Table, Query, Order
-from config import DB_PATH
+import logging
+import time
+
+import metrics
+from pypika import Table, Query, Order, PostgreSQLQuery, functions as fn
+from cache import MISSING, TTLCache
+from storage import Storage, create_storage
+from config import (
+    DB_PATH, DB_READERS, DB_POOL_SIZE, HISTORY_BATCH_SIZE, HISTORY_FLUSH_INTERVAL, HISTORY_QUEUE_SIZE, HISTORY_FLUSH_TIMEOUT,
+    HISTORY_RETENTION, HISTORY_ARCHIVE_INTERVAL, HISTORY_ARCHIVE_BATCH, POSTER_CACHE_SIZE, POSTER_CACHE_TTL, PAGE_SIZE,
+)
 
 users = Table("users")
 history = Table("history")
 watch_later = Table("watch_later")
+film_cache = Table("film_cache")
+film_links = Table("film_links")
+posters = Table("posters")
+catalog = Table("catalog")
+
+# Backend chosen by DATABASE_URL, opened in init_db.
+_storage: Storage | None = None
+
+# Users known to exist, warmed from the users table in init_db. Users are never deleted,
+# so the set stays right when other processes add users; unknown ids are checked in the table.
+# History and watch-later rows are not cached: the web app and every bot worker write them.
+_known_users: set[int] = set()
+# Poster rows by film id; they only change when a poster is first seen or sent.
+_posters = TTLCache(POSTER_CACHE_SIZE, POSTER_CACHE_TTL)
+
+# Write-behind buffer for history rows. A bounded queue gives backpressure:
+# producers wait once HISTORY_QUEUE_SIZE rows are pending.
+_history_queue: asyncio.Queue[tuple | None] = asyncio.Queue(maxsize=HISTORY_QUEUE_SIZE)
+_history_task: asyncio.Task | None = None
+_retention_task: asyncio.Task | None = None
+_history_pending: collections.Counter[int] = collections.Counter()
+_history_flushed = asyncio.Condition()
+
+metrics.register_collector(metrics.cache_collector("posters", _posters))
+metrics.register_collector(lambda: [
+    ("known_users", {}, len(_known_users)),
+    ("history_queue_size", {}, _history_queue.qsize()),
+])
+
+
+async def _fetchall(query: Query) -> list[tuple]:
+    with metrics.stage("db"):
+        return await _storage.fetchall(str(query))
+
+
+async def _fetchone(query: Query) -> tuple | None:
+    with metrics.stage("db"):
+        return await _storage.fetchone(str(query))
+
+
+# Schema migrations per dialect, applied in order. Version 1 is the original
+# SQLite schema, so its statements must stay idempotent for databases created
+# before migrations existed. Foreign keys are declared but not enforced by
+# SQLite, so the PostgreSQL schema leaves them out (the web app stores history
+# of users that never started the bot).
+MIGRATIONS: dict[str, list[tuple[int, list[str]]]] = {
+    "sqlite": [
+        (1, [
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                year INTEGER NOT NULL,
+                request_time TIMESTAMP NOT NULL,
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS watch_later (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                year INTEGER NOT NULL,
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS film_cache (
+                query TEXT PRIMARY KEY,
+                data TEXT,
+                expires_at REAL NOT NULL
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS film_links (
+                film_id INTEGER NOT NULL,
+                source TEXT NOT NULL,
+                url TEXT,
+                verified_at REAL NOT NULL,
+                PRIMARY KEY (film_id, source)
+            );
+            """,
+        ]),
+        (2, [
+            "CREATE INDEX IF NOT EXISTS history_user_time ON history (user_id, request_time DESC);",
+            """
+            DELETE FROM watch_later WHERE id NOT IN (
+                SELECT MIN(id) FROM watch_later GROUP BY user_id, name, year
+            );
+            """,
+            "CREATE UNIQUE INDEX IF NOT EXISTS watch_later_user_film ON watch_later (user_id, name, year);",
+            """
+            CREATE TABLE IF NOT EXISTS history_archive (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                year INTEGER NOT NULL,
+                request_time TIMESTAMP NOT NULL
+            );
+            """,
+        ]),
+        (3, [
+            """
+            CREATE TABLE IF NOT EXISTS posters (
+                film_id INTEGER PRIMARY KEY,
+                url TEXT,
+                file_id TEXT
+            );
+            """,
+        ]),
+        # Keyset pagination of history and watch-later pages.
+        (4, [
+            "CREATE INDEX IF NOT EXISTS history_user_time_id ON history (user_id, request_time DESC, id DESC);",
+            "DROP INDEX IF EXISTS history_user_time;",
+            "CREATE INDEX IF NOT EXISTS watch_later_user_id ON watch_later (user_id, id);",
+        ]),
+        # Film catalog; `titles` holds the title keys (suggest.title_key) of every name of the film,
+        # indexed by an external-content FTS5 table kept in sync by triggers.
+        (5, [
+            """
+            CREATE TABLE IF NOT EXISTS catalog (
+                film_id INTEGER PRIMARY KEY,
+                name TEXT,
+                alternative_name TEXT,
+                year INTEGER,
+                rating REAL,
+                votes INTEGER,
+                description TEXT,
+                poster TEXT,
+                titles TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            """,
+            "CREATE INDEX IF NOT EXISTS catalog_votes ON catalog (votes DESC);",
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS catalog_fts USING fts5(
+                titles, content='catalog', content_rowid='film_id', prefix='3'
+            );
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS catalog_ai AFTER INSERT ON catalog BEGIN
+                INSERT INTO catalog_fts (rowid, titles) VALUES (new.film_id, new.titles);
+            END;
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS catalog_ad AFTER DELETE ON catalog BEGIN
+                INSERT INTO catalog_fts (catalog_fts, rowid, titles) VALUES ('delete', old.film_id, old.titles);
+            END;
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS catalog_au AFTER UPDATE OF titles ON catalog BEGIN
+                INSERT INTO catalog_fts (catalog_fts, rowid, titles) VALUES ('delete', old.film_id, old.titles);
+                INSERT INTO catalog_fts (rowid, titles) VALUES (new.film_id, new.titles);
+            END;
+            """,
+        ]),
+    ],
+    "postgresql": [
+        (1, [
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                user_id BIGINT PRIMARY KEY
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS history (
+                id BIGSERIAL PRIMARY KEY,
+                user_id BIGINT NOT NULL,
+                name TEXT NOT NULL,
+                year INTEGER NOT NULL,
+                request_time TIMESTAMP NOT NULL
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS watch_later (
+                id BIGSERIAL PRIMARY KEY,
+                user_id BIGINT NOT NULL,
+                name TEXT NOT NULL,
+                year INTEGER NOT NULL
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS film_cache (
+                query TEXT PRIMARY KEY,
+                data TEXT,
+                expires_at DOUBLE PRECISION NOT NULL
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS film_links (
+                film_id BIGINT NOT NULL,
+                source TEXT NOT NULL,
+                url TEXT,
+                verified_at DOUBLE PRECISION NOT NULL,
+                PRIMARY KEY (film_id, source)
+            );
+            """,
+        ]),
+        (2, [
+            "CREATE INDEX IF NOT EXISTS history_user_time ON history (user_id, request_time DESC);",
+            "CREATE UNIQUE INDEX IF NOT EXISTS watch_later_user_film ON watch_later (user_id, name, year);",
+            """
+            CREATE TABLE IF NOT EXISTS history_archive (
+                id BIGINT PRIMARY KEY,
+                user_id BIGINT NOT NULL,
+                name TEXT NOT NULL,
+                year INTEGER NOT NULL,
+                request_time TIMESTAMP NOT NULL
+            );
+            """,
+        ]),
+        (3, [
+            """
+            CREATE TABLE IF NOT EXISTS posters (
+                film_id BIGINT PRIMARY KEY,
+                url TEXT,
+                file_id TEXT
+            );
+            """,
+        ]),
+        # Keyset pagination of history and watch-later pages.
+        (4, [
+            "CREATE INDEX IF NOT EXISTS history_user_time_id ON history (user_id, request_time DESC, id DESC);",
+            "DROP INDEX IF EXISTS history_user_time;",
+            "CREATE INDEX IF NOT EXISTS watch_later_user_id ON watch_later (user_id, id);",
+        ]),
+        # Film catalog, searched with the built-in full-text search over its title keys.
+        (5, [
+            """
+            CREATE TABLE IF NOT EXISTS catalog (
+                film_id BIGINT PRIMARY KEY,
+                name TEXT,
+                alternative_name TEXT,
+                year INTEGER,
+                rating DOUBLE PRECISION,
+                votes BIGINT,
+                description TEXT,
+                poster TEXT,
+                titles TEXT NOT NULL,
+                updated_at DOUBLE PRECISION NOT NULL
+            );
+            """,
+            "CREATE INDEX IF NOT EXISTS catalog_votes ON catalog (votes DESC);",
+            "CREATE INDEX IF NOT EXISTS catalog_titles ON catalog USING GIN (to_tsvector('simple', titles));",
+        ]),
+    ],
+}
+
+CATALOG_COLUMNS = "film_id, name, alternative_name, year, rating, votes, description, poster, titles"
+
+# Catalog rows whose title keys contain all the words in {words}, best matches first.
+SEARCH_CATALOG: dict[str, str] = {
+    "sqlite": f"""
+        SELECT {", ".join(f"catalog.{column}" for column in CATALOG_COLUMNS.split(", "))}
+        FROM catalog_fts JOIN catalog ON catalog.film_id = catalog_fts.rowid
+        WHERE catalog_fts MATCH '{{words}}' ORDER BY catalog_fts.rank LIMIT {{limit}}
+    """,
+    "postgresql": f"""
+        SELECT {CATALOG_COLUMNS} FROM catalog
+        WHERE to_tsvector('simple', titles) @@ to_tsquery('simple', '{{words}}')
+        ORDER BY ts_rank(to_tsvector('simple', titles), to_tsquery('simple', '{{words}}')) DESC LIMIT {{limit}}
+    """,
+}
+# Word query syntax of each dialect.
+_WORD_QUERY = {"sqlite": ('"{}"', " AND "), "postgresql": ("{}", " & ")}
+
+# A batch of at most {limit} rows of one user beyond their newest {keep}; the scan
+# walks the history_user_time_id index of that user only.
+_EXPIRED_HISTORY = """
+    SELECT id FROM history WHERE user_id = {user_id}
+    ORDER BY request_time DESC, id DESC LIMIT {limit} OFFSET {keep}
+"""
+
+# Statements moving one batch of expired history rows to history_archive; the row
+# count of the last one is the number of archived rows.
+ARCHIVE_HISTORY: dict[str, list[str]] = {
+    # The transaction holds SQLite's write lock, so both statements see the same rows.
+    "sqlite": [
+        f"""
+        INSERT INTO history_archive (id, user_id, name, year, request_time)
+        SELECT id, user_id, name, year, request_time FROM history
+        WHERE id IN ({_EXPIRED_HISTORY}) ON CONFLICT DO NOTHING;
+        """,
+        f"DELETE FROM history WHERE id IN ({_EXPIRED_HISTORY});",
+    ],
+    "postgresql": [
+        f"""
+        WITH moved AS (
+            DELETE FROM history WHERE id IN ({_EXPIRED_HISTORY})
+            RETURNING id, user_id, name, year, request_time
+        )
+        INSERT INTO history_archive (id, user_id, name, year, request_time)
+        SELECT id, user_id, name, year, request_time FROM moved ON CONFLICT DO NOTHING;
+        """,
+    ],
+}
+
+
+async def migrate(storage: Storage) -> int:
+    """Apply pending migrations, each in its own transaction; return the schema version.
+
+    Each step re-reads the version under the schema lock, so processes starting
+    together apply every migration exactly once.
+    """
+    version = 0
+    for target, statements in MIGRATIONS[storage.dialect]:
+        async with storage.transaction() as executor:
+            await storage.lock_schema(executor)
+            version = await storage.schema_version(executor)
+            if target <= version:
+                continue
+            for statement in statements:
+                await executor.execute(statement)
+            await storage.set_schema_version(executor, target)
+            version = target
+    return version
+
+
+async def archive_history(keep: int, batch: int = HISTORY_ARCHIVE_BATCH) -> int:
+    """Move all but the newest `keep` history rows of every user to history_archive.
+
+    Rows are moved in transactions of at most `batch` rows of one user, so the
+    writer lock is never held for long and other writes run in between.
+    """
+    archived = 0
+    query = Query.from_(history).select(history.user_id).groupby(history.user_id).having(fn.Count("*") > keep)
+    for (user_id,) in await _fetchall(query):
+        while True:
+            async with _storage.transaction() as executor:
+                for statement in ARCHIVE_HISTORY[_storage.dialect]:
+                    moved = await executor.execute(
+                        statement.replace("{user_id}", str(int(user_id)))
+                        .replace("{limit}", str(int(batch)))
+                        .replace("{keep}", str(int(keep)))
+                    )
+            archived += moved
+            if moved < batch:
+                break
+    return archived
 
 
-async def init_db() -> None:
-    """Initialize the database with required tables."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY
-        );
-        """)
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            name TEXT NOT NULL,
-            year INTEGER NOT NULL,
-            request_time TIMESTAMP NOT NULL,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        );
-        """)
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS watch_later (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            name TEXT NOT NULL,
-            year INTEGER NOT NULL,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        );
-        """)
-        await db.commit()
-        print("База данных инициализирована.")
-
-
-async def change_db(query: Query) -> None:
-    """Execute a database modification query."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(str(query))
-        await db.commit()
+async def _retention_loop() -> None:
+    """Periodically enforce the history retention policy."""
+    while True:
+        try:
+            archived = await archive_history(HISTORY_RETENTION)
+            if archived:
+                logging.info("В архив перенесено записей истории: %s", archived)
+        except Exception as e:
+            logging.error("Ошибка при архивации истории: %s", e)
+        await asyncio.sleep(HISTORY_ARCHIVE_INTERVAL)
+
+
+async def init_db(archive: bool = True) -> None:
+    """Open the connection pool and bring the schema up to date.
+
+    Only one process of a deployment should pass `archive`: it runs the history
+    retention loop for everyone.
+    """
+    global _storage, _history_task, _retention_task
+    if _storage is not None:
+        return
+    storage = create_storage(DB_PATH, readers=DB_READERS, pool_size=DB_POOL_SIZE)
+    await storage.connect()
+    await migrate(storage)
+    _storage = storage
+    _known_users.update(row[0] for row in await _fetchall(Query.from_(users).select(users.user_id)))
+    await change_db(Query.from_(film_cache).delete().where(film_cache.expires_at < time.time()))
+    _history_task = asyncio.create_task(_history_writer())
+    if archive and HISTORY_RETENTION > 0:
+        _retention_task = asyncio.create_task(_retention_loop())
+    logging.info("База данных инициализирована.")
+
+
+async def close_db() -> None:
+    """Flush pending history rows and close every pooled connection."""
+    global _storage, _history_task, _retention_task
+    if _storage is None:
+        return
+    if _retention_task is not None:
+        _retention_task.cancel()
+        await asyncio.gather(_retention_task, return_exceptions=True)
+        _retention_task = None
+    if _history_task is not None:
+        await _history_queue.put(None)
+        await _history_task
+        _history_task = None
+    await _storage.close()
+    _storage = None
+
+
+async def change_db(query: Query) -> int:
+    """Execute a database modification query and return the number of affected rows."""
+    with metrics.stage("db"):
+        return await _storage.execute(str(query))
+
+
+async def _flush_history(rows: list[tuple]) -> None:
+    """Insert a batch of history rows in a single transaction."""
+    query = Query.into(history).columns(
+        history.user_id, history.name, history.year, history.request_time
+    )
+    for row in rows:
+        query = query.insert(*row)
+    try:
+        await change_db(query)
+    except Exception as e:
+        logging.error("Не удалось сохранить историю (%s записей): %s", len(rows), e)
+    finally:
+        async with _history_flushed:
+            for row in rows:
+                _history_pending[row[0]] -= 1
+                if _history_pending[row[0]] <= 0:
+                    del _history_pending[row[0]]
+            _history_flushed.notify_all()
+
+
+async def _history_writer() -> None:
+    """Drain the history queue, coalescing rows into batched commits."""
+    while True:
+        rows = [await _history_queue.get()]
+        if _history_queue.qsize() < HISTORY_BATCH_SIZE and rows[0] is not None:
+            await asyncio.sleep(HISTORY_FLUSH_INTERVAL)
+        while len(rows) < HISTORY_BATCH_SIZE and not _history_queue.empty():
+            rows.append(_history_queue.get_nowait())
+        batch = [row for row in rows if row is not None]
+        if batch:
+            await _flush_history(batch)
+        if len(batch) != len(rows):
+            return
 
 
 async def db_add_user(user_id: int) -> None:
     """Add a new user to the database if not exists."""
-    if await check_user(user_id):
+    if user_id in _known_users:
         return
-    query = Query.into(users).insert(user_id)
+    query = PostgreSQLQuery.into(users).insert(user_id).on_conflict().do_nothing()
     await change_db(query)
+    _known_users.add(user_id)
 
 
 async def check_user(user_id: int) -> bool:
     """Check if a user exists in the database."""
+    if user_id in _known_users:
+        return True
+    # Another process may have added the user since the set was warmed.
     query = Query.from_(users).select(users.user_id).where(users.user_id == user_id)
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(str(query)) as cursor:
-            result = await cursor.fetchone()
-            return result is not None
+    if await _fetchone(query) is None:
+        return False
+    _known_users.add(user_id)
+    return True
 
 
 async def save_film_to_history(user_id: int, name: str, year: int) -> None:
-    """Save a film to user's history."""
-    request_time = datetime.datetime.now()
-    query = Query.into(history).columns(
-        history.user_id, history.name, history.year, history.request_time
-    ).insert(user_id, name, year, request_time)
-    await change_db(query)
+    """Queue a film for the user's history; rows are written in batches."""
+    row = (user_id, name, year, datetime.datetime.now())
+    if _history_task is None:
+        _history_pending[user_id] += 1
+        await _flush_history([row])
+    else:
+        # Counted only once queued: a cancelled put leaves nothing for readers to wait for.
+        await _history_queue.put(row)
+        _history_pending[user_id] += 1
 
 
 async def add_watch_later_films(user_id: int, name: str, year: int) -> None:
     """Add a film to user's watch later list."""
-    query = Query.into(watch_later).columns(
-        watch_later.user_id, watch_later.name, watch_later.year
-    ).insert(user_id, name, year)
-    await change_db(query)
+    await add_watch_later_batch(user_id, [(name, year)])
+
+
+async def add_watch_later_batch(user_id: int, films: list[tuple[str, int]]) -> int:
+    """Add several (name, year) films to user's watch later list in one statement; return how many were new."""
+    if not films:
+        return 0
+    query = PostgreSQLQuery.into(watch_later).columns(watch_later.user_id, watch_later.name, watch_later.year)
+    for name, year in films:
+        query = query.insert(user_id, name, year)
+    return await change_db(query.on_conflict().do_nothing())
 
 
 async def delete_watch_later_film(user_id: int, film_id: int) -> None:
     """Delete a film from user's watch later list by its ID."""
+    await delete_watch_later_batch(user_id, [film_id])
+
+
+async def delete_watch_later_batch(user_id: int, film_ids: list[int]) -> int:
+    """Delete several films from user's watch later list by ID in one statement; return how many were deleted."""
+    if not film_ids:
+        return 0
     query = Query.from_(watch_later).delete().where(
-        (watch_later.user_id == user_id) & (watch_later.id == film_id)
+        (watch_later.user_id == user_id) & watch_later.id.isin([int(film_id) for film_id in film_ids])
     )
-    await change_db(query)
+    return await change_db(query)
+
+
+def _isoformat(value: str | datetime.datetime) -> str:
+    # SQLite returns timestamps as stored text, PostgreSQL as datetime objects.
+    return value if isinstance(value, str) else value.isoformat()
 
 
 async def get_history(user_id: int) -> list[dict[str, str | int]]:
-    """Retrieve the user's film history."""
-    query = Query.from_(history).select(
-        history.name, history.year, history.request_time
-    ).where(history.user_id == user_id).orderby(history.request_time, order=Order.desc).limit(10)
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(str(query)) as cursor:
-            rows = await cursor.fetchall()
-            return [
-                {"name": row[0], "year": row[1], "request_time": row[2]}
-                for row in rows
-            ]
-
-
-async def get_watch_later_films(user_id: int) -> list[dict[str, str | int]]:
-    """Retrieve the user's watch later list."""
-    query = Query.from_(watch_later).select(
+    """Retrieve the user's latest films."""
+    films, _ = await get_history_page(user_id)
+    return films
+
+
+# Pages are fetched by keyset: a cursor names the last row of the previous page, so
+# a page costs the same index range scan however deep it is.
+def history_page_query(user_id: int, before: str | None, limit: int) -> Query:
+    """Rows of a history page (one extra to tell whether another page follows), newest first."""
+    condition = history.user_id == user_id
+    if before is not None:
+        request_time, _, row_id = before.rpartition("|")
+        if not request_time or not row_id.isdigit():
+            raise ValueError(f"invalid history cursor: {before!r}")
+        condition &= (history.request_time < request_time) | (
+            (history.request_time == request_time) & (history.id < int(row_id))
+        )
+    return Query.from_(history).select(
+        history.id, history.name, history.year, history.request_time
+    ).where(condition).orderby(history.request_time, history.id, order=Order.desc).limit(limit + 1)
+
+
+def watch_later_page_query(user_id: int, after: int | None, limit: int) -> Query:
+    """Rows of a watch later page (one extra to tell whether another page follows) in insertion order."""
+    condition = watch_later.user_id == user_id
+    if after is not None:
+        condition &= watch_later.id > after
+    return Query.from_(watch_later).select(
         watch_later.id, watch_later.name, watch_later.year
-    ).where(watch_later.user_id == user_id).orderby(watch_later.id)
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(str(query)) as cursor:
-            rows = await cursor.fetchall()
-            return [
-                {"id": row[0], "name": row[1], "year": row[2]}
-                for row in rows
-            ]
+    ).where(condition).orderby(watch_later.id).limit(limit + 1)
+
+
+async def get_history_page(
+        user_id: int, before: str | None = None, limit: int = PAGE_SIZE
+) -> tuple[list[dict[str, str | int]], str | None]:
+    """Retrieve a page of the user's film history, newest first, and the cursor of the next page."""
+    # Rows still queued in this process are waited for, unless the writer is gone.
+    if _history_pending[user_id] and (_history_task is None or not _history_task.done()):
+        try:
+            async with _history_flushed:
+                await asyncio.wait_for(
+                    _history_flushed.wait_for(lambda: not _history_pending[user_id]), HISTORY_FLUSH_TIMEOUT
+                )
+        except asyncio.TimeoutError:
+            logging.warning("История пользователя %s не записана за %s с", user_id, HISTORY_FLUSH_TIMEOUT)
+    rows = await _fetchall(history_page_query(user_id, before, limit))
+    films = [
+        {"id": row[0], "name": row[1], "year": row[2], "request_time": _isoformat(row[3])}
+        for row in rows[:limit]
+    ]
+    cursor = f"{films[-1]['request_time']}|{films[-1]['id']}" if len(rows) > limit else None
+    return films, cursor
+
+
+async def get_watch_later_page(
+        user_id: int, after: int | None = None, limit: int = PAGE_SIZE
+) -> tuple[list[dict[str, str | int]], int | None]:
+    """Retrieve a page of the user's watch later list in insertion order and the cursor of the next page."""
+    # Not cached: the web app and other bot workers change the list too, and /delete_from_watch_later
+    # numbers must refer to the rows the user was shown.
+    rows = await _fetchall(watch_later_page_query(user_id, after, limit))
+    films = [
+        {"id": row[0], "name": row[1], "year": row[2]}
+        for row in rows[:limit]
+    ]
+    return films, films[-1]["id"] if len(rows) > limit else None
+
+
+async def get_watch_later_ids(user_id: int, positions: list[int]) -> dict[int, int]:
+    """Map 1-based positions in the user's watch later list to film IDs; positions past the end are left out."""
+    if not positions:
+        return {}
+    query = Query.from_(watch_later).select(watch_later.id).where(
+        watch_later.user_id == user_id
+    ).orderby(watch_later.id).limit(max(positions))
+    ids = [row[0] for row in await _fetchall(query)]
+    return {position: ids[position - 1] for position in positions if 0 < position <= len(ids)}
 
 
 async def get_last_film(user_id: int) -> dict[str, str | int] | None:
     """Retrieve the last film from user's history."""
-    last_film = await get_history(user_id)
-    return last_film[0] if last_film else None
+    films, _ = await get_history_page(user_id, limit=1)
+    return films[0] if films else None
+
+
+async def get_cached_film(query: str) -> tuple[str | None, float] | None:
+    """Retrieve a live Kinopoisk cache entry (JSON payload or None for "not found")."""
+    cache_query = Query.from_(film_cache).select(
+        film_cache.data, film_cache.expires_at
+    ).where((film_cache.query == query) & (film_cache.expires_at >= time.time()))
+    return await _fetchone(cache_query)
+
+
+async def save_cached_film(query: str, data: str | None, expires_at: float) -> None:
+    """Store a Kinopoisk cache entry."""
+    # ON CONFLICT upserts are rendered by the PostgreSQL dialect; SQLite accepts the same syntax.
+    cache_query = PostgreSQLQuery.into(film_cache).columns(
+        film_cache.query, film_cache.data, film_cache.expires_at
+    ).insert(query, data, expires_at).on_conflict(film_cache.query).do_update(
+        film_cache.data
+    ).do_update(film_cache.expires_at)
+    await change_db(cache_query)
+
+
+async def get_film_links(film_id: int) -> dict[str, tuple[str | None, float]]:
+    """Retrieve cached watch links of a film as {source: (url, verified_at)}."""
+    query = Query.from_(film_links).select(
+        film_links.source, film_links.url, film_links.verified_at
+    ).where(film_links.film_id == film_id)
+    rows = await _fetchall(query)
+    return {row[0]: (row[1], row[2]) for row in rows}
+
+
+async def save_film_link(film_id: int, source: str, url: str | None) -> None:
+    """Store a resolved (or missing) watch link of a film."""
+    query = PostgreSQLQuery.into(film_links).columns(
+        film_links.film_id, film_links.source, film_links.url, film_links.verified_at
+    ).insert(film_id, source, url, time.time()).on_conflict(
+        film_links.film_id, film_links.source
+    ).do_update(film_links.url).do_update(film_links.verified_at)
+    await change_db(query)
+
+
+async def get_poster(film_id: int) -> tuple[str | None, str | None] | None:
+    """Retrieve the poster URL and Telegram file_id of a film."""
+    poster = _posters.get(film_id)
+    if poster is MISSING:
+        query = Query.from_(posters).select(posters.url, posters.file_id).where(posters.film_id == film_id)
+        poster = await _fetchone(query)
+        _posters.set(film_id, poster)
+    return poster
+
+
+async def save_poster_url(film_id: int, url: str | None) -> None:
+    """Remember where the poster of a film is downloaded from."""
+    poster = await get_poster(film_id)
+    if poster is not None and poster[0] == url:
+        return
+    query = PostgreSQLQuery.into(posters).columns(
+        posters.film_id, posters.url
+    ).insert(film_id, url).on_conflict(posters.film_id).do_update(posters.url)
+    await change_db(query)
+    _posters.set(film_id, (url, poster[1] if poster else None))
+
+
+async def save_poster_file_id(film_id: int, file_id: str | None) -> None:
+    """Remember the Telegram file_id of an uploaded poster, or forget it with None."""
+    query = PostgreSQLQuery.into(posters).columns(
+        posters.film_id, posters.file_id
+    ).insert(film_id, file_id).on_conflict(posters.film_id).do_update(posters.file_id)
+    await change_db(query)
+    _posters.pop(film_id)
+
+
+async def save_catalog_films(films: list[tuple]) -> int:
+    """Insert or refresh catalog rows given as tuples in CATALOG_COLUMNS order."""
+    if not films:
+        return 0
+    columns = [getattr(catalog, column) for column in CATALOG_COLUMNS.split(", ")]
+    query = PostgreSQLQuery.into(catalog).columns(*columns, catalog.updated_at)
+    now = time.time()
+    for film in films:
+        query = query.insert(*film, now)
+    query = query.on_conflict(catalog.film_id)
+    for column in (*columns[1:], catalog.updated_at):
+        query = query.do_update(column)
+    return await change_db(query)
+
+
+async def search_catalog(words: list[str], limit: int) -> list[tuple]:
+    """Find catalog films whose title keys contain every one of `words` (letters and digits only)."""
+    if not words:
+        return []
+    pattern, separator = _WORD_QUERY[_storage.dialect]
+    sql = SEARCH_CATALOG[_storage.dialect].format(
+        words=separator.join(pattern.format(word) for word in words), limit=int(limit)
+    )
+    with metrics.stage("db"):
+        return await _storage.fetchall(sql)
+
+
+async def get_catalog_films(limit: int) -> list[tuple]:
+    """Retrieve the most voted catalog films."""
+    query = Query.from_(catalog).select(
+        *(getattr(catalog, column) for column in CATALOG_COLUMNS.split(", "))
+    ).orderby(catalog.votes, order=Order.desc).limit(limit)
+    return await _fetchall(query)
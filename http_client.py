@@ -0,0 +1,97 @@
+import asyncio
+import collections
+import dataclasses
+import types
+import typing as tp
+
+import aiohttp
+
+import metrics
+from config import (
+    HTTP_LIMIT, HTTP_LIMIT_PER_HOST, HTTP_DNS_TTL, HTTP_KEEPALIVE, HTTP_TIMEOUT, HTTP_CONNECT_TIMEOUT,
+)
+
+# aiohttp decodes brotli only when the Brotli package is installed.
+try:
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+
+@dataclasses.dataclass()
+class StageStats:
+    requests: int = 0
+    errors: int = 0
+    max_time: float = 0.0
+
+
+# Upstream requests per stage, filled by the session trace hooks. Keyed by stage rather than host:
+# the set of stages is fixed, while HEAD checks reach any number of mirror domains.
+# Average latencies come from the moviebot_stage_seconds histogram.
+stage_stats: collections.defaultdict[str, StageStats] = collections.defaultdict(StageStats)
+
+
+def _collect_stage_stats() -> tp.Iterator[metrics.Sample]:
+    for stage_name, stats in stage_stats.items():
+        yield "upstream_requests_total", {"stage": stage_name}, stats.requests
+        yield "upstream_errors_total", {"stage": stage_name}, stats.errors
+        yield "upstream_max_seconds", {"stage": stage_name}, stats.max_time
+
+
+metrics.register_collector(_collect_stage_stats)
+
+
+def stage(name: str) -> dict[str, str]:
+    """Trace context naming the stage a request belongs to, e.g. session.get(url, trace_request_ctx=stage("zona"))."""
+    return {"stage": name}
+
+
+def _stage_of(context: types.SimpleNamespace) -> str:
+    return (context.trace_request_ctx or {}).get("stage", "other")
+
+
+async def _on_request_start(
+        _: aiohttp.ClientSession, context: types.SimpleNamespace, __: aiohttp.TraceRequestStartParams
+) -> None:
+    context.started = asyncio.get_running_loop().time()
+
+
+async def _on_request_end(
+        _: aiohttp.ClientSession, context: types.SimpleNamespace, params: aiohttp.TraceRequestEndParams
+) -> None:
+    elapsed = asyncio.get_running_loop().time() - context.started
+    stats = stage_stats[_stage_of(context)]
+    stats.requests += 1
+    stats.max_time = max(stats.max_time, elapsed)
+    metrics.STAGE_SECONDS.observe(elapsed, stage=_stage_of(context))
+    # 404 is an answer ("no such page"), not a failure of the upstream.
+    if params.response.status >= 400 and params.response.status != 404:
+        metrics.STAGE_ERRORS.inc(stage=_stage_of(context))
+
+
+async def _on_request_exception(
+        _: aiohttp.ClientSession, context: types.SimpleNamespace, params: aiohttp.TraceRequestExceptionParams
+) -> None:
+    stage_stats[_stage_of(context)].errors += 1
+    metrics.STAGE_SECONDS.observe(asyncio.get_running_loop().time() - context.started, stage=_stage_of(context))
+    metrics.STAGE_ERRORS.inc(stage=_stage_of(context))
+
+
+def create_session() -> aiohttp.ClientSession:
+    """Create the shared upstream session: pooled keep-alive connections, DNS cache and latency tracing."""
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(_on_request_start)
+    trace.on_request_end.append(_on_request_end)
+    trace.on_request_exception.append(_on_request_exception)
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_LIMIT,
+        limit_per_host=HTTP_LIMIT_PER_HOST,
+        ttl_dns_cache=HTTP_DNS_TTL,
+        keepalive_timeout=HTTP_KEEPALIVE,
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        trace_configs=[trace],
+    )
@@ -0,0 +1,170 @@
+import abc
+import bisect
+import collections
+import contextlib
+import time
+import typing as tp
+
+from aiohttp import web
+
+PREFIX = "moviebot_"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = tuple[tuple[str, str], ...]
+# A sample reported by a collector: metric name (without prefix), labels and value.
+# Names ending in _total are exposed as counters, everything else as gauges.
+Sample = tuple[str, dict[str, tp.Any], float]
+
+
+def _key(labels: dict[str, tp.Any]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(abc.ABC):
+    """A metric family owned by this process, registered on creation."""
+
+    type: str
+
+    def __init__(self, name: str, documentation: str) -> None:
+        self.name = PREFIX + name
+        self.documentation = documentation
+        _metrics.append(self)
+
+    @abc.abstractmethod
+    def samples(self) -> tp.Iterator[tuple[str, Labels, float]]: ...
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str) -> None:
+        super().__init__(name, documentation)
+        self._values: collections.defaultdict[Labels, float] = collections.defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels: tp.Any) -> None:
+        self._values[_key(labels)] += amount
+
+    def value(self, **labels: tp.Any) -> float:
+        return self._values.get(_key(labels), 0.0)
+
+    def samples(self) -> tp.Iterator[tuple[str, Labels, float]]:
+        for labels, value in self._values.items():
+            yield self.name, labels, value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: tp.Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: dict[Labels, list[int]] = {}
+        self._sums: collections.defaultdict[Labels, float] = collections.defaultdict(float)
+
+    def observe(self, value: float, **labels: tp.Any) -> None:
+        key = _key(labels)
+        counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+
+    def samples(self) -> tp.Iterator[tuple[str, Labels, float]]:
+        for labels, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", (*labels, ("le", _format_value(bound))), cumulative
+            yield f"{self.name}_sum", labels, self._sums[labels]
+            yield f"{self.name}_count", labels, cumulative
+
+
+_metrics: list[Metric] = []
+_collectors: list[tp.Callable[[], tp.Iterable[Sample]]] = []
+
+
+def register_collector(collect: tp.Callable[[], tp.Iterable[Sample]]) -> None:
+    """Export values kept elsewhere (stats() of caches, providers...) on every scrape."""
+    _collectors.append(collect)
+
+
+def cache_collector(name: str, cache: tp.Any) -> tp.Callable[[], tp.Iterable[Sample]]:
+    """Collector for a TTLCache-like object exposing stats()."""
+
+    def collect() -> tp.Iterator[Sample]:
+        stats = cache.stats()
+        yield "cache_entries", {"cache": name}, stats["size"]
+        yield "cache_hits_total", {"cache": name}, stats["hits"]
+        yield "cache_misses_total", {"cache": name}, stats["misses"]
+
+    return collect
+
+
+def render() -> str:
+    """Render every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for name, labels, value in metric.samples())
+    families: dict[str, list[tuple[Labels, float]]] = collections.defaultdict(list)
+    for collect in _collectors:
+        for name, labels, value in collect():
+            families[PREFIX + name].append((_key(labels), value))
+    for name, samples in families.items():
+        lines.append(f"# TYPE {name} {'counter' if name.endswith('_total') else 'gauge'}")
+        lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in samples)
+    return "\n".join(lines) + "\n"
+
+
+@contextlib.contextmanager
+def timed(histogram: Histogram, errors: Counter | None = None, **labels: tp.Any) -> tp.Iterator[None]:
+    """Observe the duration of the block; exceptions escaping it are counted in `errors`."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        if errors is not None:
+            errors.inc(**labels)
+        raise
+    finally:
+        histogram.observe(time.perf_counter() - started, **labels)
+
+
+STAGE_SECONDS = Histogram("stage_seconds", "Latency of upstream calls and storage by stage.")
+STAGE_ERRORS = Counter("stage_errors_total", "Failed upstream calls and storage operations by stage.")
+HANDLER_SECONDS = Histogram("handler_seconds", "Latency of bot handlers and web routes.")
+HANDLER_ERRORS = Counter("handler_errors_total", "Bot handlers and web routes that failed.")
+
+
+def stage(name: str) -> tp.ContextManager[None]:
+    return timed(STAGE_SECONDS, STAGE_ERRORS, stage=name)
+
+
+# ---------HTTP EXPOSITION----------
+async def handle_metrics(_: web.Request) -> web.Response:
+    return web.Response(body=render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def serve(host: str, port: int) -> web.AppRunner:
+    """Serve /metrics on a separate port (bot processes have no HTTP server of their own)."""
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
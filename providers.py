@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import time
+import typing as tp
+
+logger = logging.getLogger(__name__)
+
+SearchFunc = tp.Callable[[tp.Any], tp.Awaitable[tp.Optional[str]]]
+
+
+class UpstreamError(Exception):
+    """Raised by a provider search when the site itself fails (as opposed to "film not found")."""
+
+
+class ProviderUnavailable(Exception):
+    """Raised when a provider is skipped because its circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures and lets a single probe through once the cooldown passes."""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+    def release_probe(self) -> None:
+        """Let another probe through if the current one ended without a verdict (cancelled or crashed)."""
+        self._probing = False
+
+
+class LinkProvider:
+    """A watch-link source with its own concurrency limit, adaptive timeout, retry budget and circuit breaker."""
+
+    # Every call deposits this many retry tokens, a retry spends one.
+    RETRY_RATIO = 0.1
+    MAX_RETRY_TOKENS = 10.0
+
+    def __init__(
+            self,
+            name: str,
+            search: SearchFunc,
+            *,
+            concurrency: int,
+            timeout: float,
+            min_timeout: float,
+            max_timeout: float,
+            retries: int,
+            failure_threshold: int,
+            reset_timeout: float,
+    ) -> None:
+        self.name = name
+        self.search = search
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.retries = retries
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.latency = timeout / 3
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+        self._retry_tokens = self.MAX_RETRY_TOKENS
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    @property
+    def timeout(self) -> float:
+        """Three times the smoothed latency, clamped to the configured bounds."""
+        return min(max(self.latency * 3, self.min_timeout), self.max_timeout)
+
+    def _observe(self, latency: float) -> None:
+        self.latency = 0.8 * self.latency + 0.2 * latency
+
+    async def _attempt(self, film: tp.Any, timeout: float) -> tp.Optional[str]:
+        """One search under the circuit breaker; site failures are recorded and re-raised."""
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise ProviderUnavailable(self.name)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            url = await asyncio.wait_for(self.search(film), timeout)
+        except (UpstreamError, asyncio.TimeoutError):
+            self.failures += 1
+            self._observe(loop.time() - started)
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            # Cancelled or crashed: nothing learned about the site, but a half-open breaker
+            # must not keep waiting for this probe.
+            self.breaker.release_probe()
+            raise
+        self._observe(loop.time() - started)
+        self.breaker.record_success()
+        return url
+
+    async def find(self, film: tp.Any, deadline: float | None = None) -> tp.Optional[str]:
+        """Search for a link, raising UpstreamError or ProviderUnavailable when the site can't answer."""
+        self.calls += 1
+        self._retry_tokens = min(self._retry_tokens + self.RETRY_RATIO, self.MAX_RETRY_TOKENS)
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.retries + 1):
+            timeout = self.timeout
+            if deadline is not None:
+                timeout = min(timeout, deadline - loop.time())
+            if timeout <= 0:
+                raise UpstreamError(f"{self.name}: deadline exceeded")
+            # Waiting for a free slot is part of the attempt's budget.
+            queued = loop.time()
+            try:
+                try:
+                    await asyncio.wait_for(self._semaphore.acquire(), timeout)
+                except asyncio.TimeoutError:
+                    raise UpstreamError("no free slot") from None
+                try:
+                    timeout -= loop.time() - queued
+                    if timeout <= 0:
+                        raise UpstreamError("deadline exceeded while queued")
+                    return await self._attempt(film, timeout)
+                finally:
+                    self._semaphore.release()
+            except (UpstreamError, asyncio.TimeoutError) as e:
+                can_retry = attempt < self.retries and self._retry_tokens >= 1
+                reason = str(e) or "timeout"
+                logger.warning("⚠️ %s failed (%s)%s", self.name, reason, ", retrying" if can_retry else "")
+                if not can_retry:
+                    raise UpstreamError(f"{self.name}: {reason}") from e
+                self._retry_tokens -= 1
+
+    def stats(self) -> dict[str, tp.Any]:
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "timeout": round(self.timeout, 3),
+            "breaker": self.breaker.state,
+        }
+
+
+PROVIDERS: dict[str, LinkProvider] = {}
+
+
+def register_provider(provider: LinkProvider) -> LinkProvider:
+    PROVIDERS[provider.name] = provider
+    return provider
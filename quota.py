@@ -0,0 +1,138 @@
+import asyncio
+import dataclasses
+import datetime
+import enum
+import itertools
+import logging
+import time
+import typing as tp
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(enum.IntEnum):
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+class QuotaExceeded(Exception):
+    """Raised when no API key can serve a request right now."""
+
+
+@dataclasses.dataclass()
+class ApiKey:
+    token: str
+    daily_limit: int
+    index: int = 0
+    requests: int = 0
+    throttled: int = 0
+    used_today: int = 0
+    day: datetime.date = dataclasses.field(default_factory=datetime.date.today)
+    blocked_until: float = 0.0
+
+    @property
+    def headers(self) -> dict[str, str]:
+        return {"X-API-KEY": self.token}
+
+    @property
+    def name(self) -> str:
+        # Keys are told apart by position in TOKEN_KINOPOISK: no part of the token leaves the process.
+        return str(self.index)
+
+    def available(self, now: float) -> bool:
+        if self.day != datetime.date.today():
+            self.day, self.used_today = datetime.date.today(), 0
+        if self.daily_limit and self.used_today >= self.daily_limit:
+            return False
+        return now >= self.blocked_until
+
+
+class QuotaManager:
+    """Token bucket shared by every Kinopoisk request, rotating across several API keys.
+
+    Interactive requests are served before background ones whenever both wait for a token.
+    """
+
+    def __init__(self, tokens: list[str], rate: float, burst: int, daily_limit: int, cooldown: float) -> None:
+        self.keys = [ApiKey(token, daily_limit, index) for index, token in enumerate(tokens)]
+        self.rate = rate
+        self.burst = burst
+        self.cooldown = cooldown
+        self.waits = 0
+        self.rejected = 0
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._waiting = [0] * len(Priority)
+        self._rotation = itertools.cycle(range(len(self.keys))) if self.keys else None
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self._tokens + (now - self._updated) * self.rate, self.burst)
+        self._updated = now
+
+    async def _take(self, priority: Priority) -> None:
+        self._waiting[priority] += 1
+        try:
+            while True:
+                self._refill()
+                if self._tokens >= 1 and not any(self._waiting[:priority]):
+                    self._tokens -= 1
+                    return
+                self.waits += 1
+                await asyncio.sleep(max((1 - self._tokens) / self.rate, 0.01))
+        finally:
+            self._waiting[priority] -= 1
+
+    def _next_key(self) -> ApiKey:
+        now = time.monotonic()
+        for _ in range(len(self.keys)):
+            key = self.keys[next(self._rotation)]
+            if key.available(now):
+                return key
+        self.rejected += 1
+        raise QuotaExceeded("all Kinopoisk API keys are exhausted or throttled")
+
+    async def acquire(self, priority: Priority = Priority.INTERACTIVE) -> ApiKey:
+        """Wait for a rate-limit token and pick the next usable key."""
+        if not self.keys:
+            raise QuotaExceeded("no Kinopoisk API key configured")
+        # Fail fast instead of waiting for a token no key can use; the rotation is not advanced.
+        now = time.monotonic()
+        if not any(key.available(now) for key in self.keys):
+            self.rejected += 1
+            raise QuotaExceeded("all Kinopoisk API keys are exhausted or throttled")
+        await self._take(priority)
+        key = self._next_key()
+        key.requests += 1
+        key.used_today += 1
+        return key
+
+    def report(self, key: ApiKey, status: int) -> None:
+        """Record the response status of a request made with `key`."""
+        if status == 429:
+            key.throttled += 1
+            key.blocked_until = time.monotonic() + self.cooldown
+            logger.warning("⚠️ Kinopoisk key %s throttled for %s s", key.name, self.cooldown)
+        elif status in (401, 403):
+            # kinopoisk.dev answers 403 once the daily quota is spent
+            key.used_today = max(key.used_today, key.daily_limit)
+            tomorrow = datetime.datetime.combine(datetime.date.today() + datetime.timedelta(days=1), datetime.time())
+            key.blocked_until = time.monotonic() + (tomorrow - datetime.datetime.now()).total_seconds()
+            logger.warning("⚠️ Kinopoisk key %s is out of quota until tomorrow", key.name)
+
+    def stats(self) -> dict[str, tp.Any]:
+        now = time.monotonic()
+        return {
+            "tokens": round(self._tokens, 2),
+            "waits": self.waits,
+            "rejected": self.rejected,
+            "keys": {
+                key.name: {
+                    "requests": key.requests,
+                    "throttled": key.throttled,
+                    "used_today": key.used_today,
+                    "available": key.available(now),
+                }
+                for key in self.keys
+            },
+        }
@@ -0,0 +1,94 @@
+import asyncio
+import collections
+import logging
+import time
+import typing as tp
+
+import metrics
+import utils
+from quota import Priority
+from config import RANDOM_POOL_SIZE, RANDOM_POOL_CONCURRENCY, RANDOM_POOL_MAX_AGE
+
+logger = logging.getLogger(__name__)
+
+RandomFilm = tuple[tp.Optional[utils.FilmInfo], dict[str, tp.Optional[str]]]
+
+
+class RandomFilmPool:
+    """Background-refilled buffer of random films with their links already resolved."""
+
+    def __init__(self, size: int, concurrency: int, max_age: float, retry_delay: float = 5.0) -> None:
+        self.size = size
+        self.concurrency = concurrency
+        self.max_age = max_age
+        self.retry_delay = retry_delay
+        self.served = 0
+        self.fallbacks = 0
+        self._items: collections.deque[tuple[float, utils.FilmInfo, dict[str, tp.Optional[str]]]] = \
+            collections.deque()
+        self._slots = asyncio.Semaphore(size)
+        self._workers: list[asyncio.Task] = []
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def stats(self) -> dict[str, int]:
+        return {"ready": len(self._items), "served": self.served, "fallbacks": self.fallbacks}
+
+    def start(self) -> None:
+        """Start the refill workers."""
+        if self._workers or self.size <= 0:
+            return
+        self._workers = [asyncio.create_task(self._refill()) for _ in range(max(self.concurrency, 1))]
+
+    async def stop(self) -> None:
+        """Cancel the refill workers."""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def get(self) -> RandomFilm:
+        """Pop a fresh prefetched film, fetching one directly if the pool is empty."""
+        while self._items:
+            fetched_at, film, links = self._items.popleft()
+            self._slots.release()
+            if time.monotonic() - fetched_at <= self.max_age:
+                self.served += 1
+                return film, links
+        self.fallbacks += 1
+        return await self._fetch(Priority.INTERACTIVE)
+
+    @staticmethod
+    async def _fetch(priority: Priority) -> RandomFilm:
+        film = await utils.get_random_film(priority)
+        if film is None:
+            return None, {}
+        return film, await utils.find_links(film)
+
+    async def _refill(self) -> None:
+        while True:
+            await self._slots.acquire()
+            try:
+                film, links = await self._fetch(Priority.BACKGROUND)
+            except Exception as e:
+                logger.error("❌ Error while prefetching a random film: %s", e)
+                film, links = None, {}
+            if film is None or any(film.id == item[1].id for item in self._items):
+                self._slots.release()
+                await asyncio.sleep(self.retry_delay)
+                continue
+            self._items.append((time.monotonic(), film, links))
+
+
+random_films = RandomFilmPool(RANDOM_POOL_SIZE, RANDOM_POOL_CONCURRENCY, RANDOM_POOL_MAX_AGE)
+
+
+def _collect_random_pool() -> tp.Iterator[metrics.Sample]:
+    stats = random_films.stats()
+    yield "random_pool_ready", {}, stats["ready"]
+    yield "random_pool_served_total", {}, stats["served"]
+    yield "random_pool_fallbacks_total", {}, stats["fallbacks"]
+
+
+metrics.register_collector(_collect_random_pool)
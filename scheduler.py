@@ -0,0 +1,110 @@
+import asyncio
+import collections
+import contextlib
+import dataclasses
+import logging
+import typing as tp
+
+logger = logging.getLogger(__name__)
+
+
+class Shed(Exception):
+    """Raised when a request is dropped instead of being run."""
+
+    def __init__(self, reason: str) -> None:
+        super().__init__(reason)
+        self.reason = reason
+
+
+@dataclasses.dataclass()
+class _Waiter:
+    key: str
+    future: asyncio.Future
+
+
+class FairScheduler:
+    """Admits heavy requests (searches) under a global concurrency cap, fairly across users.
+
+    Each user runs at most `per_user` requests at a time and has at most one more waiting:
+    a newer request replaces the waiting one (the older query is superseded), and a request
+    equal to one already running or waiting is merged into it. Free slots go to waiting
+    users in the order they started waiting, so one user sending many messages cannot
+    delay the others. When `max_waiting` users already wait, new requests are shed.
+    """
+
+    def __init__(self, concurrency: int, per_user: int, max_waiting: int) -> None:
+        self.concurrency = max(concurrency, 1)
+        self.per_user = max(per_user, 1)
+        self.max_waiting = max_waiting
+        self.shed: collections.Counter[str] = collections.Counter()
+        self._running: dict[tp.Hashable, list[str]] = {}
+        self._active = 0
+        self._waiting: collections.OrderedDict[tp.Hashable, _Waiter] = collections.OrderedDict()
+
+    def _drop(self, reason: str) -> Shed:
+        self.shed[reason] += 1
+        return Shed(reason)
+
+    def _start(self, user: tp.Hashable, key: str) -> None:
+        self._running.setdefault(user, []).append(key)
+        self._active += 1
+
+    def _dispatch(self) -> None:
+        """Hand free slots to waiting users, longest waiting first."""
+        for user in list(self._waiting):
+            if self._waiting[user].future.done():
+                # Cancelled while queued, before its acquire could clean up.
+                del self._waiting[user]
+                continue
+            if self._active >= self.concurrency:
+                return
+            if len(self._running.get(user, ())) < self.per_user:
+                waiter = self._waiting.pop(user)
+                self._start(user, waiter.key)
+                waiter.future.set_result(None)
+
+    async def acquire(self, user: tp.Hashable, key: str) -> None:
+        """Wait for a slot to run `key` for `user`; raises Shed if the request is dropped."""
+        waiter = self._waiting.get(user)
+        if waiter is not None and waiter.future.done():
+            del self._waiting[user]
+            waiter = None
+        running = self._running.get(user, ())
+        if key in running or (waiter is not None and waiter.key == key):
+            raise self._drop("duplicate")
+        if waiter is None and self._active < self.concurrency and len(running) < self.per_user:
+            self._start(user, key)
+            return
+        if waiter is not None:
+            waiter.future.set_exception(self._drop("superseded"))
+        elif len(self._waiting) >= self.max_waiting:
+            raise self._drop("overloaded")
+        future = asyncio.get_running_loop().create_future()
+        # Replacing a waiter keeps the user's place in the queue.
+        self._waiting[user] = _Waiter(key, future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if self._waiting.get(user) is not None and self._waiting[user].future is future:
+                del self._waiting[user]
+            elif future.done() and not future.cancelled() and future.exception() is None:
+                self.release(user, key)
+            raise
+
+    def release(self, user: tp.Hashable, key: str) -> None:
+        self._running[user].remove(key)
+        if not self._running[user]:
+            del self._running[user]
+        self._active -= 1
+        self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, user: tp.Hashable, key: str) -> tp.AsyncIterator[None]:
+        await self.acquire(user, key)
+        try:
+            yield
+        finally:
+            self.release(user, key)
+
+    def stats(self) -> dict[str, tp.Any]:
+        return {"running": self._active, "waiting": len(self._waiting), "shed": dict(self.shed)}
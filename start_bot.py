@@ -1,9 +1,8 @@
-import logging
-import sys
 import asyncio
+from logs import setup_logging
 from telegram_bot import start_bot
 
-logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+setup_logging()
 
 if __name__ == "__main__":
     asyncio.run(start_bot())
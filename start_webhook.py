@@ -0,0 +1,9 @@
+from aiohttp import web
+from config import WEBHOOK_HOST, WEBHOOK_PORT
+from logs import setup_logging
+from webhook import create_app
+
+setup_logging()
+
+if __name__ == "__main__":
+    web.run_app(create_app(), host=WEBHOOK_HOST, port=WEBHOOK_PORT)
@@ -0,0 +1,218 @@
+import abc
+import asyncio
+import contextlib
+import typing as tp
+
+import aiosqlite
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+
+class Executor(tp.Protocol):
+    async def execute(self, sql: str) -> int: ...
+
+    async def fetchall(self, sql: str) -> list[tuple]: ...
+
+
+class Storage(abc.ABC):
+    """Connection pool of one database backend. db.py runs every query through it."""
+
+    dialect: str
+
+    @abc.abstractmethod
+    async def connect(self) -> None: ...
+
+    @abc.abstractmethod
+    async def close(self) -> None: ...
+
+    @abc.abstractmethod
+    async def fetchall(self, sql: str) -> list[tuple]: ...
+
+    async def fetchone(self, sql: str) -> tuple | None:
+        rows = await self.fetchall(sql)
+        return rows[0] if rows else None
+
+    async def execute(self, sql: str) -> int:
+        """Run a modification in its own transaction and return the affected row count."""
+        async with self.transaction() as executor:
+            return await executor.execute(sql)
+
+    @abc.abstractmethod
+    def transaction(self) -> tp.AsyncContextManager[Executor]:
+        """Run several statements atomically."""
+
+    @abc.abstractmethod
+    async def lock_schema(self, executor: Executor) -> None:
+        """Hold off other processes migrating the schema until the transaction ends."""
+
+    @abc.abstractmethod
+    async def schema_version(self, executor: Executor) -> int: ...
+
+    @abc.abstractmethod
+    async def set_schema_version(self, executor: Executor, version: int) -> None: ...
+
+
+# ---------SQLITE----------
+class _SQLiteExecutor:
+    def __init__(self, connection: aiosqlite.Connection) -> None:
+        self.connection = connection
+
+    async def execute(self, sql: str) -> int:
+        cursor = await self.connection.execute(sql)
+        return cursor.rowcount
+
+    async def fetchall(self, sql: str) -> list[tuple]:
+        async with self.connection.execute(sql) as cursor:
+            return list(await cursor.fetchall())
+
+
+class SQLiteStorage(Storage):
+    """One writer connection plus a pool of read-only connections to a SQLite file."""
+
+    dialect = "sqlite"
+
+    # Pragmas applied to every pooled connection. WAL lets readers work
+    # alongside the single writer, NORMAL sync is safe in WAL mode.
+    PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA cache_size=-16000",
+        "PRAGMA mmap_size=134217728",
+        "PRAGMA busy_timeout=5000",
+    )
+
+    def __init__(self, path: str, readers: int) -> None:
+        self.path = path
+        self.readers = max(readers, 1)
+        self._writer: aiosqlite.Connection | None = None
+        self._write_lock = asyncio.Lock()
+        self._pool: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+        self._all_readers: list[aiosqlite.Connection] = []
+
+    async def _connect(self, read_only: bool = False) -> aiosqlite.Connection:
+        """Open a connection with the pool pragmas applied."""
+        connection = await aiosqlite.connect(self.path)
+        for pragma in self.PRAGMAS:
+            await connection.execute(pragma)
+        if read_only:
+            await connection.execute("PRAGMA query_only=ON")
+        return connection
+
+    async def connect(self) -> None:
+        self._writer = await self._connect()
+        for _ in range(self.readers):
+            connection = await self._connect(read_only=True)
+            self._all_readers.append(connection)
+            self._pool.put_nowait(connection)
+
+    async def close(self) -> None:
+        async with self._write_lock:
+            await self._writer.close()
+            self._writer = None
+        while not self._pool.empty():
+            self._pool.get_nowait()
+        for connection in self._all_readers:
+            await connection.close()
+        self._all_readers.clear()
+
+    async def fetchall(self, sql: str) -> list[tuple]:
+        connection = await self._pool.get()
+        try:
+            return await _SQLiteExecutor(connection).fetchall(sql)
+        finally:
+            self._pool.put_nowait(connection)
+
+    @contextlib.asynccontextmanager
+    async def transaction(self) -> tp.AsyncIterator[Executor]:
+        async with self._write_lock:
+            # IMMEDIATE takes the database write lock up front, so a transaction that reads
+            # before writing cannot be overtaken by another process.
+            await self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                yield _SQLiteExecutor(self._writer)
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            await self._writer.commit()
+
+    async def lock_schema(self, executor: Executor) -> None:
+        # Every transaction begins IMMEDIATE and already holds the write lock.
+        pass
+
+    async def schema_version(self, executor: Executor) -> int:
+        return (await executor.fetchall("PRAGMA user_version"))[0][0]
+
+    async def set_schema_version(self, executor: Executor, version: int) -> None:
+        await executor.execute(f"PRAGMA user_version = {int(version)}")
+
+
+# ---------POSTGRESQL----------
+class _PostgresExecutor:
+    def __init__(self, connection: "asyncpg.Connection") -> None:
+        self.connection = connection
+
+    async def execute(self, sql: str) -> int:
+        # asyncpg returns a command tag such as "DELETE 3".
+        status = await self.connection.execute(sql)
+        count = status.rsplit(" ", 1)[-1]
+        return int(count) if count.isdigit() else 0
+
+    async def fetchall(self, sql: str) -> list[tuple]:
+        return [tuple(record) for record in await self.connection.fetch(sql)]
+
+
+class PostgresStorage(Storage):
+    """asyncpg connection pool, for running several bot and web processes on separate hosts."""
+
+    dialect = "postgresql"
+    # pg_advisory_xact_lock key serializing schema changes of all processes.
+    SCHEMA_LOCK = 0x6D6F7669
+
+    def __init__(self, dsn: str, pool_size: int) -> None:
+        if asyncpg is None:
+            raise RuntimeError("Для работы с PostgreSQL установите пакет asyncpg")
+        self.dsn = dsn
+        self.pool_size = max(pool_size, 1)
+        self._pool: "asyncpg.Pool | None" = None
+
+    async def connect(self) -> None:
+        self._pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=self.pool_size)
+        async with self.transaction() as executor:
+            await self.lock_schema(executor)
+            await executor.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+
+    async def close(self) -> None:
+        await self._pool.close()
+        self._pool = None
+
+    async def fetchall(self, sql: str) -> list[tuple]:
+        async with self._pool.acquire() as connection:
+            return await _PostgresExecutor(connection).fetchall(sql)
+
+    @contextlib.asynccontextmanager
+    async def transaction(self) -> tp.AsyncIterator[Executor]:
+        async with self._pool.acquire() as connection:
+            async with connection.transaction():
+                yield _PostgresExecutor(connection)
+
+    async def lock_schema(self, executor: Executor) -> None:
+        await executor.fetchall(f"SELECT pg_advisory_xact_lock({self.SCHEMA_LOCK})")
+
+    async def schema_version(self, executor: Executor) -> int:
+        rows = await executor.fetchall("SELECT MAX(version) FROM schema_version")
+        return rows[0][0] or 0
+
+    async def set_schema_version(self, executor: Executor, version: int) -> None:
+        await executor.execute("DELETE FROM schema_version")
+        await executor.execute(f"INSERT INTO schema_version (version) VALUES ({int(version)})")
+
+
+def create_storage(url: str, readers: int, pool_size: int) -> Storage:
+    """Pick the backend from DATABASE_URL: postgres(ql):// URLs or a SQLite path (optionally sqlite:///path)."""
+    if url.startswith(("postgres://", "postgresql://")):
+        return PostgresStorage(url, pool_size)
+    return SQLiteStorage(url.removeprefix("sqlite:///"), readers)
@@ -0,0 +1,141 @@
+import collections
+import dataclasses
+import re
+import typing as tp
+import unicodedata
+
+# Word prefixes longer than this share a posting list and are checked against the title itself.
+MAX_PREFIX = 8
+# Trigram candidates less similar than this are not suggested.
+MIN_SIMILARITY = 0.3
+
+# Cyrillic letters spelled the way Latin titles usually spell them; title_key() then folds
+# the remaining spelling variants, so "Матрица", "matritsa" and "matrica" share a key.
+TRANSLIT = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh", "з": "z", "и": "i",
+    "й": "i", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t",
+    "у": "u", "ф": "f", "х": "h", "ц": "c", "ч": "ch", "ш": "sh", "щ": "sch", "ъ": "", "ы": "i", "ь": "",
+    "э": "e", "ю": "iu", "я": "ia",
+})
+SPELLINGS = (("dzh", "j"), ("kh", "h"), ("ts", "c"), ("tz", "c"), ("ph", "f"), ("ck", "k"), ("x", "ks"),
+             ("q", "k"), ("w", "v"), ("yu", "iu"), ("ya", "ia"), ("y", "i"))
+_WORD = re.compile(r"[^\W_]+")
+_REPEATS = re.compile(r"(.)\1+")
+
+
+@dataclasses.dataclass()
+class _Entry:
+    titles: list[str]
+    item: tp.Any
+    weight: float
+
+
+def title_key(title: str) -> str:
+    """Spelling-insensitive form of a title: lowercase Latin words without diacritics or doubled letters."""
+    text = unicodedata.normalize("NFKD", title.casefold())
+    text = "".join(char for char in text if not unicodedata.combining(char)).translate(TRANSLIT)
+    for spelling, canonical in SPELLINGS:
+        text = text.replace(spelling, canonical)
+    return " ".join(_REPEATS.sub(r"\1", word) for word in _WORD.findall(text))
+
+
+def _words(title: str) -> list[str]:
+    return title.split()
+
+
+def _trigrams(title: str) -> set[str]:
+    padded = f"  {title} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TitleIndex:
+    """Bounded in-memory index of film titles with word-prefix and trigram (fuzzy) lookups.
+
+    Titles are normalized with `normalize` on the way in and queries are expected to be normalized the same way.
+    The least recently added or suggested entries are evicted first.
+    """
+
+    def __init__(self, maxsize: int, normalize: tp.Callable[[str], str]) -> None:
+        self.maxsize = maxsize
+        self.normalize = normalize
+        self._entries: collections.OrderedDict[tp.Hashable, _Entry] = collections.OrderedDict()
+        self._prefixes: dict[str, set[tp.Hashable]] = collections.defaultdict(set)
+        self._trigrams: dict[str, set[tp.Hashable]] = collections.defaultdict(set)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _postings(self, titles: list[str]) -> tp.Iterator[tuple[dict[str, set], str]]:
+        for title in titles:
+            for word in _words(title):
+                for i in range(1, min(len(word), MAX_PREFIX) + 1):
+                    yield self._prefixes, word[:i]
+            for gram in _trigrams(title):
+                yield self._trigrams, gram
+
+    def _unlink(self, key: tp.Hashable, entry: _Entry) -> None:
+        for postings, token in self._postings(entry.titles):
+            ids = postings.get(token)
+            if ids is not None:
+                ids.discard(key)
+                if not ids:
+                    del postings[token]
+
+    def add(self, key: tp.Hashable, titles: tp.Iterable[tp.Optional[str]], item: tp.Any, weight: float = 0) -> None:
+        """Index `item` under its titles; adding a known key replaces the old entry."""
+        titles = list(dict.fromkeys(self.normalize(title) for title in titles if title))
+        if not titles or self.maxsize <= 0:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._unlink(key, old)
+        self._entries[key] = _Entry(titles, item, weight)
+        for postings, token in self._postings(titles):
+            postings[token].add(key)
+        while len(self._entries) > self.maxsize:
+            evicted, entry = self._entries.popitem(last=False)
+            self._unlink(evicted, entry)
+
+    def _prefix_matches(self, query: str) -> dict[tp.Hashable, int]:
+        """Entries whose title words start with every query word; 2 when a title starts with the whole query."""
+        words = _words(query)
+        if not words:
+            return {}
+        candidates = set.intersection(*(self._prefixes.get(word[:MAX_PREFIX], set()) for word in words))
+        matches = {}
+        for key in candidates:
+            for title in self._entries[key].titles:
+                if title.startswith(query):
+                    matches[key] = 2
+                    break
+                title_words = _words(title)
+                if all(any(t.startswith(word) for t in title_words) for word in words):
+                    matches[key] = 1
+        return matches
+
+    def _fuzzy_matches(self, query: str) -> dict[tp.Hashable, float]:
+        grams = _trigrams(query)
+        shared = collections.Counter()
+        for gram in grams:
+            shared.update(self._trigrams.get(gram, ()))
+        matches = {}
+        for key, count in shared.items():
+            best = max(
+                count / (len(grams) + len(_trigrams(title)) - count)
+                for title in self._entries[key].titles
+            )
+            if best >= MIN_SIMILARITY:
+                matches[key] = best
+        return matches
+
+    def search(self, query: str, limit: int, fuzzy: bool = True) -> list[tp.Any]:
+        """Return up to `limit` items: prefix matches first, then (if `fuzzy`) similar titles, popular ones first."""
+        query = self.normalize(query)
+        scores: dict[tp.Hashable, float] = dict(self._prefix_matches(query))
+        if fuzzy and len(scores) < limit:
+            for key, similarity in self._fuzzy_matches(query).items():
+                scores.setdefault(key, similarity)
+        best = sorted(scores, key=lambda key: (scores[key], self._entries[key].weight), reverse=True)[:limit]
+        for key in best:
+            self._entries.move_to_end(key)
+        return [self._entries[key].item for key in best]
@@ -2,20 +2,130 @@ import asyncio
 import datetime
 import functools
 import logging
+import typing as tp
 import db
+import logs
+import metrics
 import utils
+from animation import AnimationScheduler
+from random_pool import random_films
+from scheduler import FairScheduler, Shed
 
 from aiogram.exceptions import TelegramBadRequest
-from aiogram import Bot, Dispatcher
+from aiogram import Bot, Dispatcher, F, flags
+from aiogram.dispatcher.flags import get_flag
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
 from aiogram.enums import ParseMode
 from aiogram.filters import CommandStart, Command
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, BotCommand
-from config import BOT_TOKEN
+from aiogram.types import (
+    Message, InlineKeyboardMarkup, InlineKeyboardButton, BotCommand,
+    InlineQuery, InlineQueryResultArticle, InputTextMessageContent, FSInputFile, CallbackQuery,
+)
+from config import (
+    BOT_TOKEN, PROGRESSIVE_REPLY, PROGRESSIVE_GRACE, SUGGEST_LIMIT,
+    ANIMATION_TICK, ANIMATION_CHAT_INTERVAL, ANIMATION_GLOBAL_RATE, ANIMATION_MAX_DURATION,
+    METRICS_HOST, METRICS_PORT, TELEGRAM_API_URL, SEARCH_CONCURRENCY, SEARCH_PER_USER, SEARCH_QUEUE_SIZE,
+)
+
+
+bot = Bot(
+    token=BOT_TOKEN,
+    session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None,
+    default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+)
+dp = Dispatcher()
+animations = AnimationScheduler(
+    bot,
+    tick=ANIMATION_TICK,
+    chat_interval=ANIMATION_CHAT_INTERVAL,
+    global_rate=ANIMATION_GLOBAL_RATE,
+    max_duration=ANIMATION_MAX_DURATION,
+)
+searches = FairScheduler(SEARCH_CONCURRENCY, SEARCH_PER_USER, SEARCH_QUEUE_SIZE)
+_metrics_runner = None
 
 
-bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-dp = Dispatcher()
+class TelegramMetrics(BaseRequestMiddleware):
+    """Time every Bot API call as the "telegram" stage."""
+
+    async def __call__(
+            self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot, method: TelegramMethod[TelegramType]
+    ) -> Response[TelegramType]:
+        with metrics.stage("telegram"):
+            return await make_request(bot, method)
+
+
+async def handler_metrics(handler: tp.Callable, event: tp.Any, data: dict[str, tp.Any]) -> tp.Any:
+    """Time handlers and count the ones that fail."""
+    with metrics.timed(metrics.HANDLER_SECONDS, metrics.HANDLER_ERRORS, handler=data["handler"].callback.__name__):
+        return await handler(event, data)
+
+
+async def update_request_id(handler: tp.Callable, event: tp.Any, data: dict[str, tp.Any]) -> tp.Any:
+    """Tag everything logged while handling an update with its id."""
+    token = logs.request_id.set(f"tg-{event.update_id}")
+    try:
+        return await handler(event, data)
+    finally:
+        logs.request_id.reset(token)
+
+
+async def order_user_updates(handler: tp.Callable, event: tp.Any, data: dict[str, tp.Any]) -> tp.Any:
+    """Run the updates of one user one at a time when the caller passes a `user_lock` (webhook workers).
+
+    Searches are exempt: queued behind the lock they would never reach the search scheduler together.
+    """
+    lock = data.get("user_lock")
+    if lock is None or get_flag(data, "search"):
+        return await handler(event, data)
+    async with lock:
+        return await handler(event, data)
+
+
+async def schedule_searches(handler: tp.Callable, event: Message, data: dict[str, tp.Any]) -> tp.Any:
+    """Run handlers flagged `search` through the fair scheduler; shed messages are not handled."""
+    if not get_flag(data, "search") or event.from_user is None:
+        return await handler(event, data)
+    try:
+        async with searches.slot(event.from_user.id, (event.text or "").strip().casefold()):
+            return await handler(event, data)
+    except Shed as e:
+        if e.reason == "overloaded":
+            await event.answer("\U000023F3 Сейчас слишком много запросов. Попробуйте через минуту.")
+        logging.info("Запрос пользователя %s отброшен: %s", event.from_user.id, e.reason)
+
+
+def _collect_searches() -> tp.Iterator[metrics.Sample]:
+    stats = searches.stats()
+    yield "searches_running", {}, stats["running"]
+    yield "searches_waiting", {}, stats["waiting"]
+    for reason, count in stats["shed"].items():
+        yield "searches_shed_total", {"reason": reason}, count
+
+
+def _collect_animations() -> tp.Iterator[metrics.Sample]:
+    stats = animations.stats()
+    yield "animations_active", {}, stats["active"]
+    yield "animation_edits_sent_total", {}, stats["edits_sent"]
+    yield "animation_edits_skipped_total", {}, stats["edits_skipped"]
+    yield "animation_edits_saved_total", {}, stats["edits_saved"]
+
+
+bot.session.middleware(TelegramMetrics())
+dp.update.outer_middleware(update_request_id)
+# Registered first, so that handler latency excludes the time spent waiting for the user's turn or a slot.
+for observer in (dp.message, dp.inline_query, dp.callback_query):
+    observer.middleware(order_user_updates)
+dp.message.middleware(schedule_searches)
+for observer in (dp.message, dp.inline_query, dp.callback_query):
+    observer.middleware(handler_metrics)
+metrics.register_collector(_collect_animations)
+metrics.register_collector(_collect_searches)
 
 
 def generate_keyboard(urls_dict: dict[str, str]) -> InlineKeyboardMarkup:
@@ -32,57 +142,120 @@ def command_handler(command_name: str, loading_text: str):
     def decorator(func):
         @functools.wraps(func)
         async def wrapper(message: Message, *args, **kwargs):
-            if not await db.check_user(message.from_user.id):
-                await db.db_add_user(message.from_user.id)
+            await db.db_add_user(message.from_user.id)
             message_animation = await bot.send_message(message.chat.id, loading_text)
-            asyncio.create_task(
-                loading_animation(message.chat.id, message_animation.message_id, loading_text)
-            )
+            animations.start(message.chat.id, message_animation.message_id, loading_text)
             try:
                 await func(message, message_animation.message_id, *args, **kwargs)
             except Exception as e:
-                logging.error(f"Ошибка в команде {command_name}: {e}")
+                logging.error("Ошибка в команде %s: %s", command_name, e)
+                metrics.HANDLER_ERRORS.inc(handler=func.__name__)
                 await message.answer(
                     "\U0001F6AB Произошла ошибка. Попробуйте позже."
                 )
+            finally:
+                animations.stop(message.chat.id, message_animation.message_id)
 
         return wrapper
 
     return decorator
 
 
-async def loading_animation(chat_id: int, message_id: int, text: str) -> None:
-    """Show a loading animation while processing."""
-    states = [1, 2, 3, 2]
-    for i in range(100):
-        try:
-            await asyncio.sleep(0.1)
-            new_text = f"{text}{' ' * states[i % 4]}{'\U0001F50D'}"
-            await bot.edit_message_text(text=new_text, chat_id=chat_id, message_id=message_id)
-        except TelegramBadRequest:
-            break
+async def finish_loading(chat_id: int, message_id: int) -> None:
+    """Stop the loading animation and remove its message."""
+    animations.stop(chat_id, message_id)
+    await bot.delete_message(chat_id, message_id)
 
 
-async def film_info_message(message: Message, film: utils.FilmInfo, lordfilm: str, zona: str) -> None:
-    """Send a message with information about a film."""
+LINK_LABELS = {"lordfilm": "Lordfilm", "zona": "Zona"}
+
+
+def film_caption(film: utils.FilmInfo, links: dict[str, str | None]) -> str:
+    """Build the caption of a film card."""
     rating_kp = film.rating.get("kp")
     votes_kp = film.votes.get("kp")
     rating_info = f"\u2B50 Рейтинг Кинопоиска: <b>{rating_kp}/10</b> ({votes_kp} голосов)\n" \
         if rating_kp and votes_kp else "\u2B50 Рейтинг не найден\n"
     film_description = film.description if film.description else "Описание отсутствует \u2639"
-    await bot.send_photo(
+    links_title = "\U0001F517 Ссылки для просмотра:" if any(links.values()) else ""
+    return (
+        f"<b>{film.name}</b> ({film.year})\n\n"
+        f"{film_description}\n\n"
+        f"{rating_info}\n"
+        f"<i>{links_title}</i>"
+    )
+
+
+def links_keyboard(links: dict[str, str | None]) -> InlineKeyboardMarkup:
+    """Generate a keyboard with watch links."""
+    return generate_keyboard({LINK_LABELS.get(source, source): url for source, url in links.items()})
+
+
+# posters row holding the file_id of the placeholder image
+NO_POSTER_ID = 0
+
+
+async def _send_card(
+        message: Message, film: utils.FilmInfo, links: dict[str, str | None], poster_id: int, url: str | None
+) -> Message:
+    """Send a film card, uploading the poster once and reusing its Telegram file_id afterwards."""
+    poster = await db.get_poster(poster_id)
+    file_id = poster[1] if poster else None
+    if file_id:
+        try:
+            return await bot.send_photo(
+                chat_id=message.chat.id,
+                photo=file_id,
+                caption=film_caption(film, links),
+                reply_markup=links_keyboard(links),
+            )
+        except TelegramBadRequest as e:
+            logging.warning("Сохранённый постер %s не принят: %s", poster_id, e)
+    card = await bot.send_photo(
         chat_id=message.chat.id,
-        photo=film.poster,
-        caption=(
-            f"<b>{film.name}</b> ({film.year})\n\n"
-            f"{film_description}\n\n"
-            f"{rating_info}\n"
-            f"<i>{'\U0001F517 Ссылки для просмотра:' if lordfilm or zona else ''}</i>"
-        ),
-        reply_markup=generate_keyboard(
-            {"Lordfilm": lordfilm, "Zona": zona}
-        )
+        photo=url or FSInputFile(utils.NO_POSTER_PATH),
+        caption=film_caption(film, links),
+        reply_markup=links_keyboard(links),
     )
+    if card.photo:
+        await db.save_poster_file_id(poster_id, card.photo[-1].file_id)
+    return card
+
+
+async def film_info_message(message: Message, film: utils.FilmInfo, links: dict[str, str | None]) -> Message:
+    """Send a message with information about a film."""
+    if film.id is None or not film.poster:
+        return await _send_card(message, film, links, NO_POSTER_ID, None)
+    try:
+        return await _send_card(message, film, links, film.id, film.poster)
+    except TelegramBadRequest as e:
+        # Telegram could not download the poster.
+        logging.warning("Не удалось отправить постер фильма %s: %s", film.id, e)
+        return await _send_card(message, film, links, NO_POSTER_ID, None)
+
+
+async def progressive_film_info_message(message: Message, film: utils.FilmInfo, loading_id: int) -> None:
+    """Send the film card as soon as possible and add watch links as they are found."""
+    tasks = await utils.link_tasks(film)
+    done, pending = await asyncio.wait(tasks.values(), timeout=PROGRESSIVE_GRACE)
+    links = {source: task.result() if task in done else None for source, task in tasks.items()}
+    await finish_loading(message.chat.id, loading_id)
+    card = await film_info_message(message, film, links)
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        found = {source: task.result() for source, task in tasks.items() if task in done and task.result()}
+        if not found:
+            continue
+        links.update(found)
+        try:
+            await bot.edit_message_caption(
+                chat_id=card.chat.id,
+                message_id=card.message_id,
+                caption=film_caption(film, links),
+                reply_markup=links_keyboard(links),
+            )
+        except TelegramBadRequest as e:
+            logging.warning("Не удалось обновить ссылки: %s", e)
 
 
 async def update(film: utils.FilmInfo, user_id: int) -> None:
@@ -100,9 +273,9 @@ async def set_default_commands():
         BotCommand(command="history", description="История поиска фильмов"),
         BotCommand(command="watch_later", description="Просмотр списка 'Посмотреть позже'"),
         BotCommand(command="add_to_watch_later",
-                   description="Добавить последний найденный фильм в 'Посмотреть позже'"),
+                   description="Добавить последний фильм или фильмы из истории по номерам в 'Посмотреть позже'"),
         BotCommand(command="delete_from_watch_later",
-                   description="Удалить фильм из 'Посмотреть позже' по номеру"),
+                   description="Удалить фильмы из 'Посмотреть позже' по номерам"),
     ]
     await bot.set_my_commands(commands)
 
@@ -127,43 +300,69 @@ async def cmd_help(message: Message):
         "/random - Случайный фильм\n\n"
         "/history - История поиска фильмов\n\n"
         "/watch_later - Просмотр списка 'Посмотреть позже'\n\n"
-        "/add_to_watch_later - Добавить последний найденный фильм в 'Посмотреть позже'\n\n"
-        "/delete_from_watch_later - Удалить фильм из 'Посмотреть позже' по номеру\n\n"
+        "/add_to_watch_later - Добавить последний найденный фильм в 'Посмотреть позже', "
+        "с номерами (/add_to_watch_later 1 3) — фильмы из истории\n\n"
+        "/delete_from_watch_later 1 3 - Удалить фильмы из 'Посмотреть позже' по номерам\n\n"
     )
 
 
 @dp.message(Command("random"))
 @command_handler("random", "\U0001F4E1 Ищу случайный фильм")
+@flags.search
 async def random_handler(message: Message, loading_id: int) -> None:
     """Handle the random film command."""
-    film: utils.FilmInfo = await utils.get_random_film()
+    film, links = await random_films.get()
     if film:
-        lordfilm, zona = await asyncio.gather(
-            utils.find_lordfilm(film),
-            utils.find_zona(film),
-        )
         await update(film, message.from_user.id)
-        await bot.delete_message(message.chat.id, loading_id)
-        await film_info_message(message, film, lordfilm, zona)
+        await finish_loading(message.chat.id, loading_id)
+        await film_info_message(message, film, links)
     else:
-        await bot.delete_message(message.chat.id, loading_id)
+        await finish_loading(message.chat.id, loading_id)
         await message.answer("\U0001F6AB Не удалось найти случайный фильм. Попробуйте снова!")
 
 
+# Largest list number /add_to_watch_later and /delete_from_watch_later accept.
+MAX_POSITION = 100
+
+
+def parse_positions(text: str) -> list[int]:
+    """Parse the list numbers given after a command."""
+    positions = [int(arg) for arg in text.split()[1:]]
+    if any(position < 1 for position in positions):
+        raise ValueError("positions start at 1")
+    return list(dict.fromkeys(positions))
+
+
+def more_keyboard(kind: str, start: int, cursor: str | int | None) -> InlineKeyboardMarkup | None:
+    """A "more" button requesting the page after `cursor`, numbered from `start`."""
+    if cursor is None:
+        return None
+    button = InlineKeyboardButton(text="Ещё \u2B07", callback_data=f"{kind}:{start}:{cursor}")
+    return InlineKeyboardMarkup(inline_keyboard=[[button]])
+
+
+def history_page_text(films: list[dict], start: int) -> str:
+    """Format a page of history entries numbered from `start`."""
+    return "\n".join(
+        f"<b>{start + i}. {film['name']}</b> ({film['year']}) — "
+        f"{datetime.datetime.fromisoformat(film['request_time']).strftime('%d.%m.%Y %H:%M')}"
+        for i, film in enumerate(films)
+    )
+
+
+def watch_later_page_text(films: list[dict], start: int) -> str:
+    """Format a page of the watch later list numbered from `start`."""
+    return "\n".join(f"<b>{start + i}. {film['name']}</b> ({film['year']})" for i, film in enumerate(films))
+
+
 @dp.message(Command("history"))
 async def history_handler(message: Message) -> None:
     """Handle the history command."""
-    films = await db.get_history(message.from_user.id)
+    films, cursor = await db.get_history_page(message.from_user.id)
     if films:
-        formatted_history = "\n".join(
-            [
-                f"<b>{i + 1}. {film['name']}</b> ({film['year']}) — "
-                f"{datetime.datetime.fromisoformat(film['request_time']).strftime('%d.%m.%Y %H:%M')}"
-                for i, film in enumerate(films)
-            ]
-        )
         await message.answer(
-            f"\U0001F4D6 <b>История поиска фильмов:</b>\n\n{formatted_history}"
+            f"\U0001F4D6 <b>История поиска фильмов:</b>\n\n{history_page_text(films, 1)}",
+            reply_markup=more_keyboard("history", 1 + len(films), cursor),
         )
     else:
         await message.answer("\U0001F625 История пуста.")
@@ -172,81 +371,160 @@ async def history_handler(message: Message) -> None:
 @dp.message(Command("watch_later"))
 async def watch_later_handler(message: Message) -> None:
     """Handle the watch later command."""
-    films = await db.get_watch_later_films(message.from_user.id)
+    films, cursor = await db.get_watch_later_page(message.from_user.id)
     if films:
-        formatted_watch_later = "\n".join(
-            [
-                f"<b>{i + 1}. {film['name']}</b> ({film['year']})"
-                for i, film in enumerate(films)
-            ]
-        )
         await message.answer(
-            f"\U0001F4CC <b>Список 'Посмотреть позже':</b>\n\n{formatted_watch_later}"
+            f"\U0001F4CC <b>Список 'Посмотреть позже':</b>\n\n{watch_later_page_text(films, 1)}",
+            reply_markup=more_keyboard("watch_later", 1 + len(films), cursor),
         )
     else:
         await message.answer("\U0001F625 Список пуст.")
 
 
+@dp.callback_query(F.data.startswith(("history:", "watch_later:")))
+async def more_handler(callback: CallbackQuery) -> None:
+    """Send the next page of the history or the watch later list."""
+    kind, start, cursor = callback.data.split(":", 2)
+    start = int(start)
+    try:
+        if kind == "history":
+            films, next_cursor = await db.get_history_page(callback.from_user.id, cursor)
+            text = history_page_text(films, start)
+        else:
+            films, next_cursor = await db.get_watch_later_page(callback.from_user.id, int(cursor))
+            text = watch_later_page_text(films, start)
+    except ValueError:
+        await callback.answer("\U000026A0 Список устарел, запросите его заново.")
+        return
+    await callback.message.edit_reply_markup(reply_markup=None)
+    if films:
+        await callback.message.answer(text, reply_markup=more_keyboard(kind, start + len(films), next_cursor))
+    await callback.answer()
+
+
 @dp.message(Command("add_to_watch_later"))
 async def add_to_watch_later_handler(message: Message) -> None:
-    """Handle the command to add a film to the watch later list."""
-    film = await db.get_last_film(message.from_user.id)
-    if film:
-        await db.add_watch_later_films(message.from_user.id, film["name"], film["year"])
+    """Handle the command to add the last film, or films from the history by number, to the watch later list."""
+    try:
+        positions = parse_positions(message.text)
+    except ValueError:
+        positions = None
+    if positions is None or any(position > MAX_POSITION for position in positions):
         await message.answer(
-            f"\U00002705 Фильм <b>{film['name']}</b> ({film['year']}) добавлен в список Посмотреть позже."
-        )
-    else:
-        await message.answer("\U0001F625 Не найдено последних фильмов для добавления.")
+            "\U000026A0 Укажите номера фильмов из /history (не больше "
+            f"{MAX_POSITION}). Пример: /add_to_watch_later 1 3")
+        return
+    if not positions:
+        film = await db.get_last_film(message.from_user.id)
+        if film:
+            await db.add_watch_later_films(message.from_user.id, film["name"], film["year"])
+            await message.answer(
+                f"\U00002705 Фильм <b>{film['name']}</b> ({film['year']}) добавлен в список Посмотреть позже."
+            )
+        else:
+            await message.answer("\U0001F625 Не найдено последних фильмов для добавления.")
+        return
+    history, _ = await db.get_history_page(message.from_user.id, limit=max(positions))
+    films = list(dict.fromkeys(
+        (history[position - 1]["name"], history[position - 1]["year"])
+        for position in positions if position <= len(history)
+    ))
+    if not films:
+        await message.answer("\U000026A0 Неверные номера фильмов. Попробуйте снова.")
+        return
+    added = await db.add_watch_later_batch(message.from_user.id, films)
+    names = ", ".join(f"<b>{name}</b> ({year})" for name, year in films)
+    await message.answer(f"\U00002705 Добавлено в список 'Посмотреть позже': {added}.\n{names}")
 
 
 @dp.message(Command("delete_from_watch_later"))
 async def delete_from_watch_later_handler(message: Message) -> None:
-    """Handle the command to delete a film from the watch later list."""
+    """Handle the command to delete films from the watch later list by number."""
     try:
-        _, film_number = message.text.split()
-        film_number = int(film_number) - 1
-        films = await db.get_watch_later_films(message.from_user.id)
-
-        if 0 <= film_number < len(films):
-            film_id = films[film_number]["id"]
-            await db.delete_watch_later_film(message.from_user.id, film_id)
-            await message.answer(
-                f"\U00002705 Фильм <b>{films[film_number]['name']}</b> удален из списка 'Посмотреть позже'."
-            )
-        else:
-            await message.answer("\U000026A0 Неверный номер фильма. Попробуйте снова.")
-    except (ValueError, IndexError):
+        positions = parse_positions(message.text)
+        if not positions or any(position > MAX_POSITION for position in positions):
+            raise ValueError("no positions or a position out of range")
+    except ValueError:
         await message.answer(
-            "\U000026A0 Пожалуйста, укажите корректный номер фильма после команды. Пример: /delete_from_watch_later 1")
+            "\U000026A0 Пожалуйста, укажите корректные номера фильмов после команды (не больше "
+            f"{MAX_POSITION}). Пример: /delete_from_watch_later 1 3")
+        return
+    ids = await db.get_watch_later_ids(message.from_user.id, positions)
+    if not ids:
+        await message.answer("\U000026A0 Неверный номер фильма. Попробуйте снова.")
+        return
+    deleted = await db.delete_watch_later_batch(message.from_user.id, list(ids.values()))
+    numbers = ", ".join(str(position) for position in sorted(ids))
+    await message.answer(f"\U00002705 Удалено из списка 'Посмотреть позже': {deleted} (номера {numbers}).")
+
+
+@dp.inline_query()
+async def inline_search_handler(inline_query: InlineQuery) -> None:
+    """Suggest films while the user types an inline query."""
+    films = await utils.search_films(inline_query.query, SUGGEST_LIMIT)
+    results = [
+        InlineQueryResultArticle(
+            id=str(film.id or i),
+            title=f"{film.name or film.alternative_name} ({film.year})",
+            description=film.alternative_name or film.description,
+            thumbnail_url=film.poster,
+            input_message_content=InputTextMessageContent(message_text=film_caption(film, {})),
+        )
+        for i, film in enumerate(films)
+    ]
+    await inline_query.answer(results, cache_time=300)
 
 
 @dp.message()
 @command_handler("search", "Ищу фильм")
+@flags.search
 async def search_handler(message: Message, loading_id: int) -> None:
     """Handle the search command."""
     film: utils.FilmInfo = await utils.get_film_by_name(message.text)
     if film:
-        lordfilm, zona = await asyncio.gather(
-            utils.find_lordfilm(film),
-            utils.find_zona(film),
-        )
         await update(film, message.from_user.id)
-        await bot.delete_message(message.chat.id, loading_id)
-        await film_info_message(message, film, lordfilm, zona)
+        if PROGRESSIVE_REPLY:
+            await progressive_film_info_message(message, film, loading_id)
+            return
+        links = await utils.find_links(film)
+        await finish_loading(message.chat.id, loading_id)
+        await film_info_message(message, film, links)
     else:
-        await bot.delete_message(message.chat.id, loading_id)
+        await finish_loading(message.chat.id, loading_id)
         await message.answer(
             "\U0001F625 К сожалению мне не удалось найти этот фильм."
         )
 
 
+async def on_startup(metrics_port: int = METRICS_PORT, archive: bool = True) -> None:
+    """Prepare shared resources of a bot process; `archive` runs the history retention loop."""
+    global _metrics_runner
+    await db.init_db(archive=archive)
+    await utils.init_session()
+    await utils.warm_title_index()
+    random_films.start()
+    if metrics_port:
+        _metrics_runner = await metrics.serve(METRICS_HOST, metrics_port)
+
+
+async def on_shutdown() -> None:
+    """Release shared resources of a bot process."""
+    global _metrics_runner
+    if _metrics_runner is not None:
+        await _metrics_runner.cleanup()
+        _metrics_runner = None
+    await random_films.stop()
+    await utils.close_session()
+    await db.close_db()
+
+
 async def start_bot() -> None:
     """Main entry point for the bot."""
     try:
-        await db.init_db()
-        await utils.init_session()
+        await on_startup()
         await set_default_commands()
         await dp.start_polling(bot)
     except Exception as e:
-        logging.critical(f"Critical error while starting the bot: {e}")
+        logging.critical("Critical error while starting the bot: %s", e)
+    finally:
+        await on_shutdown()
@@ -0,0 +1,45 @@
+import asyncio
+import unittest
+
+from scheduler import FairScheduler, Shed
+
+
+class CancelledWaiterTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.scheduler = FairScheduler(concurrency=1, per_user=1, max_waiting=10)
+        await self.scheduler.acquire("a", "x")
+        self.waiting = asyncio.create_task(self.scheduler.acquire("b", "y"))
+        await asyncio.sleep(0)
+
+    async def test_release_skips_cancelled_waiter(self) -> None:
+        # The slot is freed before the cancelled acquire gets to clean up.
+        self.waiting.cancel()
+        self.scheduler.release("a", "x")
+        with self.assertRaises(asyncio.CancelledError):
+            await self.waiting
+        self.assertEqual(self.scheduler.stats(), {"running": 0, "waiting": 0, "shed": {}})
+        await asyncio.wait_for(self.scheduler.acquire("c", "z"), 1)
+
+    async def test_new_request_replaces_cancelled_waiter(self) -> None:
+        for key in ("y", "z"):  # the cancelled key again, or a newer one
+            with self.subTest(key=key):
+                await self.asyncSetUp()
+                # The new request arrives before the cancelled acquire gets to clean up.
+                self.waiting.cancel()
+                asyncio.get_running_loop().call_soon(self.scheduler.release, "a", "x")
+                await self.scheduler.acquire("b", key)
+                with self.assertRaises(asyncio.CancelledError):
+                    await self.waiting
+                self.assertEqual(self.scheduler.stats(), {"running": 1, "waiting": 0, "shed": {}})
+
+    async def test_newer_request_supersedes_waiter(self) -> None:
+        newer = asyncio.create_task(self.scheduler.acquire("b", "z"))
+        with self.assertRaises(Shed):
+            await self.waiting
+        self.scheduler.release("a", "x")
+        await asyncio.wait_for(newer, 1)
+        self.assertEqual(self.scheduler.stats()["shed"], {"superseded": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,24 +1,67 @@
 import asyncio
+import concurrent.futures
 import dataclasses
+import io
+import json
+import mimetypes
+import multiprocessing
+import os
+import pathlib
+import time
 import aiohttp
 import typing as tp
 import logging
 
-from config import TOKEN_KINOPOISK, ZONA_URL
-from bs4 import BeautifulSoup
+import db
+import http_client
+import logs
+import metrics
+from cache import MISSING, TTLCache
+from config import (
+    TOKENS_KINOPOISK, KINOPOISK_RATE, KINOPOISK_BURST, KINOPOISK_DAILY_LIMIT, KINOPOISK_KEY_COOLDOWN,
+    KINOPOISK_URL, GOOGLE_URL, ZONA_URL, LINKS_TTL, LINKS_NEGATIVE_TTL, LINKS_DEADLINE,
+    PROVIDER_CONCURRENCY, PROVIDER_TIMEOUT, PROVIDER_MIN_TIMEOUT, PROVIDER_MAX_TIMEOUT,
+    PROVIDER_RETRIES, PROVIDER_FAILURE_THRESHOLD, PROVIDER_RESET_TIMEOUT,
+    PARSER_EXECUTOR, PARSER_WORKERS,
+    FILM_CACHE_SIZE, FILM_CACHE_TTL, FILM_CACHE_NEGATIVE_TTL, FILM_CACHE_PERSISTENT,
+    SUGGEST_LIMIT, SUGGEST_INDEX_SIZE, SUGGEST_MIN_QUERY, POSTER_DIR, POSTER_WIDTH,
+    CATALOG_ENABLED, CATALOG_CANDIDATES, CATALOG_WARM_SIZE,
+)
+from bs4 import BeautifulSoup, SoupStrainer
+from quota import Priority, QuotaExceeded, QuotaManager
+from suggest import TitleIndex, title_key
+from providers import PROVIDERS, LinkProvider, ProviderUnavailable, UpstreamError, register_provider
 
-# Logging configuration
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Constants.
 
-HEADERS_KINOPOISK = {'X-API-KEY': TOKEN_KINOPOISK}
+kinopoisk_quota = QuotaManager(
+    TOKENS_KINOPOISK,
+    rate=KINOPOISK_RATE,
+    burst=KINOPOISK_BURST,
+    daily_limit=KINOPOISK_DAILY_LIMIT,
+    cooldown=KINOPOISK_KEY_COOLDOWN,
+)
+
+
+def _collect_quota() -> tp.Iterator[metrics.Sample]:
+    stats = kinopoisk_quota.stats()
+    yield "kinopoisk_quota_tokens", {}, stats["tokens"]
+    yield "kinopoisk_quota_waits_total", {}, stats["waits"]
+    yield "kinopoisk_quota_rejected_total", {}, stats["rejected"]
+    for name, key in stats["keys"].items():
+        yield "kinopoisk_key_requests_total", {"key": name}, key["requests"]
+        yield "kinopoisk_key_throttled_total", {"key": name}, key["throttled"]
+        yield "kinopoisk_key_available", {"key": name}, int(key["available"])
+
+
+metrics.register_collector(_collect_quota)
 USER_AGENT_HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
                   ' (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
     'Accept-Language': 'en-US,en;q=0.9,ru;q=0.8',
-    'Accept-Encoding': "utf-8",
+    'Accept-Encoding': http_client.ACCEPT_ENCODING,
     'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
     'Connection': 'keep-alive',
     'Cache-Control': 'no-cache',
@@ -40,8 +83,7 @@ class FilmInfo:
 
 # Helper function to extract movie information from a page response
 def film_info_from_page(page: dict) -> FilmInfo:
-    poster = page.get("poster")
-    poster_url = poster.get("url") if poster.get("url", None) else "https://imgur.com/eEmOQBt"
+    poster_url = (page.get("poster") or {}).get("url") or None
     return FilmInfo(
         id=page.get("id"),
         name=page.get("name"),
@@ -57,94 +99,418 @@ def film_info_from_page(page: dict) -> FilmInfo:
 session: aiohttp.ClientSession | None = None
 
 
-# Initialize an aiohttp session
+# Initialize the shared aiohttp session (once per process)
 async def init_session():
     global session
-    session = aiohttp.ClientSession()
+    if session is None or session.closed:
+        session = http_client.create_session()
+
+
+# Stop the background work started by lookups; called before the session and the database close
+async def _stop_background_tasks():
+    catalog = _catalog_task
+    tasks = [task for task in (*_background_tasks, *_in_flight.values()) if task is not catalog]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    # Films waiting for the catalog are saved, not dropped.
+    if catalog is not None:
+        await asyncio.gather(catalog, return_exceptions=True)
+    await _flush_catalog()
+
+
+# Close the shared aiohttp session and the parser pool
+async def close_session():
+    global session, _parser_pool
+    await _stop_background_tasks()
+    if session is not None:
+        await session.close()
+        session = None
+    if _parser_pool is not None:
+        pool, _parser_pool = _parser_pool, None
+        await asyncio.to_thread(pool.shutdown, cancel_futures=True)
 
 
 # Retrieve a random movie
-async def get_random_film() -> tp.Optional[FilmInfo]:
-    url = "https://api.kinopoisk.dev/v1.4/movie/random"
+async def get_random_film(priority: Priority = Priority.INTERACTIVE) -> tp.Optional[FilmInfo]:
+    url = f"{KINOPOISK_URL}/movie/random"
     params = {
         "votes.kp": "2000-6666666",
         "notNullFields": ["description"]
     }
     try:
-        async with session.get(url, headers=HEADERS_KINOPOISK, params=params) as response:
+        api_key = await kinopoisk_quota.acquire(priority)
+        async with session.get(
+                url, headers=api_key.headers, params=params, trace_request_ctx=http_client.stage("kinopoisk")
+        ) as response:
+            kinopoisk_quota.report(api_key, response.status)
             if response.status == 200:
-                logger.info(f"✅ Request status: {response.status}")
+                logger.info("✅ Request status: %s", response.status, extra=logs.SAMPLED)
                 page = await response.json()
-                return film_info_from_page(page)
+                film = film_info_from_page(page)
+                _index_film(film)
+                return film
             else:
-                logger.warning(f"⚠️ Failed to retrieve a movie. Status code: {response.status}")
-    except aiohttp.ClientError as e:
-        logger.error(f"❌ Connection error: {e}")
+                logger.warning("⚠️ Failed to retrieve a movie. Status code: %s", response.status)
+    except QuotaExceeded as e:
+        logger.warning("⚠️ %s", e)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error("❌ Connection error: %s", e)
     return None
 
 
+# ---------KINOPOISK CACHE----------
+# Search results keyed by the normalized query. None marks a "not found" entry.
+film_cache = TTLCache(FILM_CACHE_SIZE, FILM_CACHE_TTL)
+film_cache_db_hits = 0
+metrics.register_collector(metrics.cache_collector("film", film_cache))
+metrics.register_collector(lambda: [("film_cache_db_hits_total", {}, film_cache_db_hits)])
+
+
+def normalize_query(name: str) -> str:
+    return " ".join(name.casefold().replace("ё", "е").split())
+
+
+async def _load_cached_film(key: str) -> tp.Any:
+    """Look the query up in the persistent cache tier."""
+    global film_cache_db_hits
+    entry = await db.get_cached_film(key)
+    if entry is None:
+        return MISSING
+    data, expires_at = entry
+    film = FilmInfo(**json.loads(data)) if data else None
+    if film:
+        _index_film(film)
+    film_cache.set(key, film, ttl=expires_at - time.time())
+    film_cache_db_hits += 1
+    return film
+
+
+async def _remember_film(key: str, film: tp.Optional[FilmInfo]) -> None:
+    ttl = FILM_CACHE_TTL if film else FILM_CACHE_NEGATIVE_TTL
+    if film:
+        _index_film(film)
+    film_cache.set(key, film, ttl=ttl)
+    if FILM_CACHE_PERSISTENT:
+        data = json.dumps(dataclasses.asdict(film), ensure_ascii=False) if film else None
+        await db.save_cached_film(key, data, time.time() + ttl)
+
+
+# ---------SUGGESTIONS----------
+# Every film seen so far is indexed by its titles, so that popular titles are suggested
+# without an upstream call. Upstream top-N results are cached per query like single films.
+title_index = TitleIndex(SUGGEST_INDEX_SIZE, normalize_query)
+search_cache = TTLCache(FILM_CACHE_SIZE, FILM_CACHE_TTL)
+SUGGESTIONS = metrics.Counter("suggestions_total", "Answers of search_films by source.")
+metrics.register_collector(metrics.cache_collector("search", search_cache))
+metrics.register_collector(lambda: [("suggest_index_entries", {}, len(title_index))])
+
+
+def _index_title(film: FilmInfo) -> None:
+    votes = (film.votes or {}).get("kp") or 0
+    title_index.add(film.id or (film.name, film.year), (film.name, film.alternative_name), film, weight=votes)
+
+
+def _index_film(film: FilmInfo) -> None:
+    """Index a film received from Kinopoisk and add it to the catalog."""
+    _index_title(film)
+    _catalog_film(film)
+
+
+# ---------CATALOG----------
+# Every film received from Kinopoisk is kept in the catalog table (written in the background, in
+# batches) and searched by title key before asking Kinopoisk, so that titles seen before are answered
+# offline. The most voted catalog films are loaded into the suggestion index on startup.
+_catalog_pending: dict[int, FilmInfo] = {}
+_catalog_task: asyncio.Task | None = None
+CATALOG_LOOKUPS = metrics.Counter("catalog_lookups_total", "Film searches looked up in the catalog by result.")
+metrics.register_collector(lambda: [("catalog_pending", {}, len(_catalog_pending))])
+
+
+def _film_titles(film: FilmInfo) -> list[str]:
+    return list(dict.fromkeys(key for key in map(title_key, (film.name or "", film.alternative_name or "")) if key))
+
+
+def _catalog_row(film: FilmInfo) -> tuple:
+    year = int(film.year) if film.year else None
+    return (
+        film.id, film.name, film.alternative_name, year, (film.rating or {}).get("kp"),
+        (film.votes or {}).get("kp") or 0, film.description, film.poster, " | ".join(_film_titles(film)),
+    )
+
+
+def _film_from_catalog(row: tuple) -> FilmInfo:
+    film_id, name, alternative_name, year, rating, votes, description, poster, _ = row
+    return FilmInfo(film_id, name, alternative_name, year, {"kp": rating}, {"kp": votes}, description, poster)
+
+
+async def _flush_catalog() -> None:
+    while _catalog_pending:
+        films = list(_catalog_pending.values())
+        _catalog_pending.clear()
+        try:
+            await db.save_catalog_films([_catalog_row(film) for film in films])
+        except Exception as e:
+            logger.error("❌ Error while saving films to the catalog: %s", e)
+
+
+def _catalog_film(film: FilmInfo) -> None:
+    global _catalog_task
+    if not CATALOG_ENABLED or film.id is None or not _film_titles(film):
+        return
+    _catalog_pending[film.id] = film
+    if _catalog_task is None or _catalog_task.done():
+        _catalog_task = asyncio.create_task(_flush_catalog())
+        _background_tasks.add(_catalog_task)
+        _catalog_task.add_done_callback(_background_tasks.discard)
+
+
+async def _catalog_lookup(key: str) -> tp.Optional[FilmInfo]:
+    """The most voted catalog film with a title spelled like the query (same title key).
+
+    Only exact key matches are answered: a merely similar title ("Пила" / "Пилат") may be another film,
+    and the answer is cached. Typos are left to Kinopoisk and to suggestions.
+    """
+    query = title_key(key)
+    rows = await db.search_catalog(query.split(), CATALOG_CANDIDATES)
+    matches = [row for row in rows if query in row[-1].split(" | ")]
+    if not matches:
+        return None
+    return _film_from_catalog(max(matches, key=lambda row: row[5] or 0))
+
+
+async def warm_title_index() -> None:
+    """Load the most voted catalog films into the suggestion index."""
+    if not CATALOG_ENABLED:
+        return
+    rows = await db.get_catalog_films(min(CATALOG_WARM_SIZE, SUGGEST_INDEX_SIZE))
+    # Least voted first, so that the most popular films are the last to be evicted.
+    for row in reversed(rows):
+        _index_title(_film_from_catalog(row))
+    logger.info("✅ Suggestion index warmed with %s catalog films", len(rows))
+
+
+# ---------SINGLE FLIGHT----------
+# Concurrent identical lookups share one in-flight task and its result.
+_in_flight: dict[tp.Hashable, asyncio.Task] = {}
+
+
+async def _single_flight(key: tp.Hashable, factory: tp.Callable[[], tp.Awaitable[tp.Any]]) -> tp.Any:
+    task = _in_flight.get(key)
+    if task is None:
+        task = asyncio.create_task(factory())
+        _in_flight[key] = task
+        task.add_done_callback(lambda _: _in_flight.pop(key, None))
+    # Shielded so that one cancelled caller does not cancel the lookup for everyone else.
+    return await asyncio.shield(task)
+
+
 # Search for a movie by name
 async def get_film_by_name(name: str) -> tp.Optional[FilmInfo]:
-    url = "https://api.kinopoisk.dev/v1.4/movie/search"
+    key = normalize_query(name)
+    film = film_cache.get(key)
+    if film is MISSING and FILM_CACHE_PERSISTENT:
+        film = await _load_cached_film(key)
+    if film is not MISSING:
+        return film
+    if CATALOG_ENABLED:
+        try:
+            film = await _catalog_lookup(key)
+        except Exception as e:
+            logger.error("❌ Catalog lookup failed: %s", e)
+            film = None
+        CATALOG_LOOKUPS.inc(result="hit" if film else "miss")
+        if film:
+            _index_title(film)
+            film_cache.set(key, film)
+            return film
+    return await _single_flight(("film", key), lambda: _fetch_film_by_name(name, key))
+
+
+async def _fetch_film_by_name(name: str, key: str) -> tp.Optional[FilmInfo]:
+    url = f"{KINOPOISK_URL}/movie/search"
     try:
-        async with session.get(url, headers=HEADERS_KINOPOISK, params={"query": name}) as response:
+        api_key = await kinopoisk_quota.acquire(Priority.INTERACTIVE)
+        async with session.get(
+                url, headers=api_key.headers, params={"query": name}, trace_request_ctx=http_client.stage("kinopoisk")
+        ) as response:
+            kinopoisk_quota.report(api_key, response.status)
             if response.status == 200:
-                logger.info(f"✅ Request status: {response.status}")
+                logger.info("✅ Request status: %s", response.status, extra=logs.SAMPLED)
                 src = await response.json()
                 if not src.get("docs"):
                     logger.warning("⚠️ Movie not found")
+                    await _remember_film(key, None)
                     return None
                 page = src.get("docs", [None])[0]
-                return film_info_from_page(page)
+                film = film_info_from_page(page)
+                await _remember_film(key, film)
+                return film
+            else:
+                logger.warning("⚠️ Error during movie search. Status code: %s", response.status)
+    except QuotaExceeded as e:
+        logger.warning("⚠️ %s", e)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error("❌ Connection error: %s", e)
+    return None
+
+
+# Top-N candidates for a query, for search-as-you-type
+async def search_films(query: str, limit: int = SUGGEST_LIMIT) -> list[FilmInfo]:
+    key = normalize_query(query)
+    if not key:
+        return []
+    films = title_index.search(key, limit, fuzzy=False)
+    if len(films) >= limit or len(key) < SUGGEST_MIN_QUERY:
+        SUGGESTIONS.inc(source="index")
+        return films
+    found = search_cache.get((key, limit))
+    if found is MISSING:
+        SUGGESTIONS.inc(source="upstream")
+        found = await _single_flight(("search", key, limit), lambda: _fetch_films(query, key, limit))
+    else:
+        SUGGESTIONS.inc(source="cache")
+    # Without an upstream answer fall back to whatever the local index has.
+    return list(found) if found is not None else title_index.search(key, limit)
+
+
+async def _fetch_films(query: str, key: str, limit: int) -> tp.Optional[list[FilmInfo]]:
+    url = f"{KINOPOISK_URL}/movie/search"
+    try:
+        api_key = await kinopoisk_quota.acquire(Priority.INTERACTIVE)
+        async with session.get(
+                url,
+                headers=api_key.headers,
+                params={"query": query, "limit": limit},
+                trace_request_ctx=http_client.stage("kinopoisk"),
+        ) as response:
+            kinopoisk_quota.report(api_key, response.status)
+            if response.status == 200:
+                src = await response.json()
+                films = [film_info_from_page(page) for page in src.get("docs") or []]
+                search_cache.set((key, limit), films, ttl=FILM_CACHE_TTL if films else FILM_CACHE_NEGATIVE_TTL)
+                # The first candidate is what a full search for the same query would return.
+                await _remember_film(key, films[0] if films else None)
+                for film in films:
+                    _index_film(film)
+                return films
             else:
-                logger.warning(f"⚠️ Error during movie search. Status code: {response.status}")
-    except aiohttp.ClientError as e:
-        logger.error(f"❌ Connection error: {e}")
+                logger.warning("⚠️ Error during movie suggestions. Status code: %s", response.status)
+    except QuotaExceeded as e:
+        logger.warning("⚠️ %s", e)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error("❌ Connection error: %s", e)
     return None
 
 
-# Helper function for requesting data by URL
-async def _async_request(url: str, params: dict = None) -> tp.Tuple[tp.Optional[int], tp.Optional[str]]:
+# Helper function for requesting data by URL (time is bounded by the calling provider)
+async def _async_request(
+        url: str, params: dict = None, stage: str = "other"
+) -> tp.Tuple[tp.Optional[int], tp.Optional[str]]:
     try:
-        async with session.get(url=url, params=params, headers=USER_AGENT_HEADERS, timeout=1) as response:
+        async with session.get(
+                url=url, params=params, headers=USER_AGENT_HEADERS, trace_request_ctx=http_client.stage(stage)
+        ) as response:
             if response.status == 200:
                 text = await response.text()
                 return response.status, text
             else:
-                logger.warning(f"⚠️ Request error: {response.status}")
+                logger.warning("⚠️ Request error: %s", response.status)
                 return response.status, None
     except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-        logger.error(f"❌ Connection error: {e}")
+        logger.error("❌ Connection error: %s", e)
         return None, None
 
 
+def _raise_for_upstream(site: str, status: tp.Optional[int]) -> None:
+    """Treat connection errors, throttling and server errors as a failure of the site."""
+    if status is None or status == 429 or status >= 500:
+        raise UpstreamError(f"{site} request failed with status {status}")
+
+
 async def _check_url(url: str) -> bool:
     try:
-        async with session.head(url, headers=USER_AGENT_HEADERS, timeout=1) as response:
+        async with session.head(
+                url, headers=USER_AGENT_HEADERS, timeout=1, trace_request_ctx=http_client.stage("head")
+        ) as response:
             return response.status == 200
     except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-        logger.error(f"❌ Connection error: {e}")
+        logger.error("❌ Connection error: %s", e)
         return False
 
 
+# ---------HTML PARSING----------
+# lxml is optional; it is several times faster than the pure Python parser.
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+
+def _has_class(name: str) -> tp.Callable[[tp.Any], bool]:
+    return lambda value: value is not None and name in (value.split() if isinstance(value, str) else value)
+
+
+# Only the result blocks are turned into a tree, the rest of the page is skipped
+GOOGLE_RESULTS = SoupStrainer(attrs={"jsname": "UWckNb"})
+ZONA_RESULTS = SoupStrainer(class_=_has_class("results-item-wrap"))
+
+# Parsing is CPU-bound, so it runs off the event loop; the pool is created on first use
+_parser_pool: concurrent.futures.Executor | None = None
+
+
+def _create_parser_pool() -> concurrent.futures.Executor:
+    if PARSER_EXECUTOR == "process":
+        # Daemonic processes (webhook workers) are not allowed to have children.
+        if not multiprocessing.current_process().daemon:
+            return concurrent.futures.ProcessPoolExecutor(PARSER_WORKERS)
+        logging.warning("⚠️ PARSER_EXECUTOR=process is not available in a daemon process, parsing in threads")
+    return concurrent.futures.ThreadPoolExecutor(PARSER_WORKERS, thread_name_prefix="parser")
+
+
+def parse_google_links(text: str) -> list[str]:
+    soup = BeautifulSoup(text, HTML_PARSER, parse_only=GOOGLE_RESULTS)
+    return [item.get("href") for item in soup.find_all(attrs={"jsname": "UWckNb"})[:3]]
+
+
+def parse_zona_results(text: str) -> list[tuple[str, str]]:
+    soup = BeautifulSoup(text, HTML_PARSER, parse_only=ZONA_RESULTS)
+    results = []
+    for item in soup.find_all(class_=_has_class("results-item-wrap")):
+        year, link = item.find(attrs={"class": "results-item-year"}), item.find("a")
+        if year is not None and link is not None:
+            results.append((year.text.strip(), link.get("href")))
+    return results
+
+
+async def _parse(parser: tp.Callable[[str], tp.Any], text: str) -> tp.Any:
+    global _parser_pool
+    if _parser_pool is None:
+        _parser_pool = _create_parser_pool()
+    return await asyncio.get_running_loop().run_in_executor(_parser_pool, parser, text)
+
+
 # ---------LORDFILM----------
 # Search for a movie link on the LordFilm website
 async def find_lordfilm(film: FilmInfo) -> tp.Optional[str]:
     query = f"{film.name} {film.year} lordfilm"
-    status, text = await _async_request("https://www.google.com/search", params={"q": query})
+    status, text = await _async_request(f"{GOOGLE_URL}/search", params={"q": query}, stage="google")
+    _raise_for_upstream("Google", status)
+    if not text:
+        return None
     try:
-        soup = BeautifulSoup(text, "html.parser")
-        all_links = [item.get("href") for item in soup.find_all(attrs={"jsname": "UWckNb"})[:3]]
-        links = [link for link in all_links if "lordfilm" in link and link.startswith("https:/")]
+        all_links = await _parse(parse_google_links, text)
+        links = [link for link in all_links if link and "lordfilm" in link and link.startswith("https:/")]
         tasks = [asyncio.create_task(_check_url(link)) for link in links]
         results = await asyncio.gather(*tasks)
 
         for status, link in zip(results, links):
             if status:
-                logger.info(f"✅ Found LordFilm link: {link}")
+                logger.info("✅ Found LordFilm link: %s", link, extra=logs.SAMPLED)
                 return link
     except Exception as e:
-        logger.error(f"❌ Error while processing LordFilm: {e}")
+        logger.error("❌ Error while processing LordFilm: %s", e)
 
     return None
 
@@ -153,17 +519,183 @@ async def find_lordfilm(film: FilmInfo) -> tp.Optional[str]:
 # Search for a movie link on the Zona website
 async def find_zona(film: FilmInfo) -> tp.Optional[str]:
     search_url = f"{ZONA_URL}/search/{film.name}%20"
-    status, text = await _async_request(search_url)
+    status, text = await _async_request(search_url, stage="zona")
+    _raise_for_upstream("Zona", status)
     if not text:
         return None
     try:
-        soup = BeautifulSoup(text, "html.parser")
-        for item in soup.find_all(attrs={"class": "results-item-wrap"}):
-            item_year = item.find(attrs={"class": "results-item-year"}).text
-            if int(item_year) == film.year:
-                link = item.find("a").get("href")
-                logger.info(f"✅ Found Zona link: {ZONA_URL}{link}")
+        for item_year, link in await _parse(parse_zona_results, text):
+            if item_year.isdigit() and int(item_year) == film.year:
+                logger.info("✅ Found Zona link: %s%s", ZONA_URL, link, extra=logs.SAMPLED)
                 return f"{ZONA_URL}{link}"
     except Exception as e:
-        logger.error(f"❌ Error while processing Zona: {e}")
+        logger.error("❌ Error while processing Zona: %s", e)
     return None
+
+
+# ---------LINK PROVIDERS----------
+for _name, _search in (("lordfilm", find_lordfilm), ("zona", find_zona)):
+    register_provider(LinkProvider(
+        _name,
+        _search,
+        concurrency=PROVIDER_CONCURRENCY,
+        timeout=PROVIDER_TIMEOUT,
+        min_timeout=PROVIDER_MIN_TIMEOUT,
+        max_timeout=PROVIDER_MAX_TIMEOUT,
+        retries=PROVIDER_RETRIES,
+        failure_threshold=PROVIDER_FAILURE_THRESHOLD,
+        reset_timeout=PROVIDER_RESET_TIMEOUT,
+    ))
+
+
+def _collect_providers() -> tp.Iterator[metrics.Sample]:
+    for name, provider in PROVIDERS.items():
+        stats = provider.stats()
+        yield "provider_calls_total", {"provider": name}, stats["calls"]
+        yield "provider_failures_total", {"provider": name}, stats["failures"]
+        yield "provider_rejected_total", {"provider": name}, stats["rejected"]
+        yield "provider_timeout_seconds", {"provider": name}, stats["timeout"]
+        yield "provider_breaker_open", {"provider": name}, int(stats["breaker"] != "closed")
+
+
+metrics.register_collector(_collect_providers)
+
+
+# ---------LINK CACHE----------
+_revalidating: set[tuple[int, str]] = set()
+_background_tasks: set[asyncio.Task] = set()
+LINK_LOOKUPS = metrics.Counter("link_lookups_total", "Watch link lookups by provider and result.")
+
+
+# Only definitive answers are cached: provider failures propagate to the caller
+async def _resolve_link(film: FilmInfo, source: str, deadline: float | None = None) -> tp.Optional[str]:
+    url = await PROVIDERS[source].find(film, deadline)
+    if film.id is not None:
+        await db.save_film_link(film.id, source, url)
+    return url
+
+
+async def _revalidate_link(film: FilmInfo, source: str, url: str) -> None:
+    """Re-check a stale cached link, scraping again only if it is dead."""
+    try:
+        if await _check_url(url):
+            await db.save_film_link(film.id, source, url)
+        else:
+            await _resolve_link(film, source)
+    except Exception as e:
+        logger.error("❌ Error while revalidating %s link: %s", source, e)
+    finally:
+        _revalidating.discard((film.id, source))
+
+
+def _schedule_revalidation(film: FilmInfo, source: str, url: str) -> None:
+    if (film.id, source) in _revalidating:
+        return
+    _revalidating.add((film.id, source))
+    task = asyncio.create_task(_revalidate_link(film, source, url))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def _find_link(
+        film: FilmInfo, source: str, cached: tuple[tp.Optional[str], float] | None, deadline: float
+) -> tp.Optional[str]:
+    if cached is not None:
+        url, verified_at = cached
+        age = time.time() - verified_at
+        if url and age > LINKS_TTL:
+            _schedule_revalidation(film, source, url)
+        if url or age <= LINKS_NEGATIVE_TTL:
+            LINK_LOOKUPS.inc(provider=source, result="cached")
+            return url
+    LINK_LOOKUPS.inc(provider=source, result="scraped")
+    try:
+        if film.id is None:
+            return await _resolve_link(film, source, deadline)
+        return await _single_flight(("link", film.id, source), lambda: _resolve_link(film, source, deadline))
+    except ProviderUnavailable:
+        return None
+    except Exception as e:
+        logger.error("❌ Error while resolving %s link: %s", source, e)
+        return None
+
+
+# Start resolving watch links for a movie, one task per provider; cached links resolve without scraping.
+# Every task finishes within LINKS_DEADLINE, so callers get results in completion order.
+async def link_tasks(film: FilmInfo) -> dict[str, asyncio.Task]:
+    cached = await db.get_film_links(film.id) if film.id is not None else {}
+    deadline = asyncio.get_running_loop().time() + LINKS_DEADLINE
+    return {
+        source: asyncio.create_task(_find_link(film, source, cached.get(source), deadline))
+        for source in PROVIDERS
+    }
+
+
+# Find watch links for a movie from every provider
+async def find_links(film: FilmInfo) -> dict[str, tp.Optional[str]]:
+    tasks = await link_tasks(film)
+    results = await asyncio.gather(*tasks.values())
+    return dict(zip(tasks, results))
+
+
+# ---------POSTERS----------
+# Posters are downloaded once, shrunk when Pillow is installed, and kept in POSTER_DIR.
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+NO_POSTER_PATH = pathlib.Path(__file__).parent / "images" / "no_poster_img.png"
+POSTER_EXTENSIONS = (".jpg", ".png", ".webp", ".gif")
+
+
+def _thumbnail(data: bytes) -> bytes:
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert("RGB")
+        image.thumbnail((POSTER_WIDTH, POSTER_WIDTH * 2))
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=85, optimize=True)
+    return output.getvalue()
+
+
+def _store_poster(path: pathlib.Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_suffix(".tmp")
+    temporary.write_bytes(data)
+    os.replace(temporary, path)
+
+
+async def _download_poster(film_id: int) -> pathlib.Path:
+    poster = await db.get_poster(film_id)
+    if poster is None or not poster[0]:
+        return NO_POSTER_PATH
+    try:
+        async with session.get(poster[0], trace_request_ctx=http_client.stage("poster")) as response:
+            if response.status != 200:
+                logger.warning("⚠️ Poster request error: %s", response.status)
+                return NO_POSTER_PATH
+            data = await response.read()
+            extension = mimetypes.guess_extension(response.content_type)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error("❌ Connection error: %s", e)
+        return NO_POSTER_PATH
+    if Image is not None:
+        try:
+            data, extension = await asyncio.to_thread(_thumbnail, data), ".jpg"
+        except Exception as e:
+            logger.error("❌ Error while resizing poster %s: %s", film_id, e)
+            return NO_POSTER_PATH
+    if extension not in POSTER_EXTENSIONS:
+        extension = ".jpg"
+    path = pathlib.Path(POSTER_DIR) / f"{film_id}{extension}"
+    await asyncio.to_thread(_store_poster, path, data)
+    return path
+
+
+# Local copy of a film poster, or the placeholder image if it has none
+async def poster_file(film_id: int) -> pathlib.Path:
+    for extension in POSTER_EXTENSIONS:
+        path = pathlib.Path(POSTER_DIR) / f"{film_id}{extension}"
+        if path.exists():
+            return path
+    return await _single_flight(("poster", film_id), lambda: _download_poster(film_id))
@@ -1,4 +1,4 @@
-from quart import Quart, render_template, request, redirect, url_for, session
+from quart import Quart, Response, g, render_template, request, redirect, send_file, url_for, session
 from quart_auth import (
     AuthUser,
     login_user,
@@ -8,16 +8,51 @@ from quart_auth import (
     Unauthorized,
     QuartAuth
 )
-import hashlib, hmac
+from markupsafe import Markup
 import asyncio
+import dataclasses
+import datetime
+import gzip
+import hashlib, hmac
+import json
+import pathlib
+import re
+import time
+import logs
+import metrics
 import utils
 import db
-from config import BOT_TOKEN, SECRET_KEY
+from cache import MISSING, TTLCache
+from config import (
+    BOT_TOKEN, SECRET_KEY, SUGGEST_LIMIT, POSTER_MAX_AGE, RESULT_CACHE_SIZE, RESULT_CACHE_TTL, GZIP_MIN_SIZE,
+    WEB_ARCHIVE_HISTORY, METRICS_HOST, WEB_METRICS_PORT,
+)
 
 app = Quart(__name__)
 app.secret_key = SECRET_KEY
 QuartAuth(app)
 
+# Rendered film cards by film id, shared by all users.
+film_cards = TTLCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+metrics.register_collector(metrics.cache_collector("film_cards", film_cards))
+
+def _templates_version() -> str:
+    """Hash of the template files: the same in every worker and replica, and unchanged by restarts."""
+    digest = hashlib.sha256()
+    folder = pathlib.Path(app.root_path, app.template_folder)
+    for path in sorted(folder.rglob("*")):
+        if path.is_file():
+            digest.update(path.relative_to(folder).as_posix().encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
+
+# Part of every page ETag, so that a deploy with changed templates invalidates them.
+RENDER_VERSION = _templates_version()
+COMPRESSIBLE = {"text/html", "text/plain", "text/css", "application/json", "application/javascript"}
+REQUEST_ID = re.compile(r"[A-Za-z0-9-]{1,64}")
+# Server of the internal /metrics endpoint, started in startup.
+_metrics_runner = None
+
 @app.errorhandler(Unauthorized)
 async def redirect_to_login(*_):
     return redirect(url_for("login_page"))
@@ -31,8 +66,98 @@ def check_telegram_auth(data: dict) -> bool:
 
 @app.before_serving
 async def startup():
+    global _metrics_runner
+    logs.setup_logging()
     await utils.init_session()
-    await db.init_db()
+    await db.init_db(archive=WEB_ARCHIVE_HISTORY)
+    await utils.warm_title_index()
+    # /metrics is served on the internal address only, never next to the public routes.
+    if WEB_METRICS_PORT:
+        _metrics_runner = await metrics.serve(METRICS_HOST, WEB_METRICS_PORT)
+
+@app.after_serving
+async def shutdown():
+    global _metrics_runner
+    if _metrics_runner is not None:
+        await _metrics_runner.cleanup()
+        _metrics_runner = None
+    await utils.close_session()
+    await db.close_db()
+
+@app.before_request
+async def start_timer():
+    g.request_started = time.perf_counter()
+    # The ID is copied into log lines and the response, so only short plain tokens are kept.
+    supplied = request.headers.get("X-Request-ID", "")
+    g.request_id = supplied if REQUEST_ID.fullmatch(supplied) else logs.new_request_id()
+    logs.request_id.set(g.request_id)
+
+@app.after_request
+async def record_request(response: Response) -> Response:
+    if request.endpoint and "request_started" in g:
+        handler = f"web_{request.endpoint}"
+        metrics.HANDLER_SECONDS.observe(time.perf_counter() - g.request_started, handler=handler)
+        if response.status_code >= 500:
+            metrics.HANDLER_ERRORS.inc(handler=handler)
+    if "request_id" in g:
+        response.headers["X-Request-ID"] = g.request_id
+    return response
+
+@app.after_request
+async def compress(response: Response) -> Response:
+    if (
+            response.status_code != 200
+            or response.mimetype not in COMPRESSIBLE
+            or "Content-Encoding" in response.headers
+            or "gzip" not in request.headers.get("Accept-Encoding", "")
+    ):
+        return response
+    data = await response.get_data()
+    if len(data) < GZIP_MIN_SIZE:
+        return response
+    # Large bodies are compressed off the event loop.
+    if len(data) > 64 * 1024:
+        data = await asyncio.to_thread(gzip.compress, data, 5)
+    else:
+        data = gzip.compress(data, 5)
+    response.set_data(data)
+    response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    return response
+
+async def conditional_page(template: str, last_modified: datetime.datetime | None = None, **context) -> Response:
+    """Render a per-user page unless the client already has this version (304 by ETag or Last-Modified)."""
+    payload = json.dumps([RENDER_VERSION, template, context], sort_keys=True, default=str)
+    etag = hashlib.sha1(payload.encode()).hexdigest()
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains_weak(etag)
+    else:
+        since = request.if_modified_since
+        not_modified = since is not None and last_modified is not None and last_modified.replace(microsecond=0) <= since
+    if not_modified:
+        response = Response("", status=304)
+    else:
+        response = Response(await render_template(template, **context))
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add("Cookie")
+    return response
+
+async def film_card(film: utils.FilmInfo) -> Markup:
+    """Film description with watch links, rendered once per film and shared between users."""
+    card = film_cards.get(film.id) if film.id is not None else MISSING
+    if card is MISSING:
+        links = await utils.find_links(film)
+        card = Markup(await render_template("film_card.html",
+                                            film=film,
+                                            lordfilm=links["lordfilm"],
+                                            zona=links["zona"]))
+        if film.id is not None:
+            film_cards.set(film.id, card)
+    return card
 
 @app.route("/auth", methods=["GET", "POST"])
 async def telegram_auth():
@@ -75,18 +200,29 @@ async def search_result():
     query = request.args.get("query", "")
     film = await utils.get_film_by_name(query)
     if film:
-        lordfilm, zona = await asyncio.gather(
-            utils.find_lordfilm(film),
-            utils.find_zona(film)
-        )
+        card = await film_card(film)
         user_id = int(current_user.auth_id)
         await db.save_film_to_history(user_id, film.name, int(film.year))
-        return await render_template("result.html",
-                                     film=film,
-                                     lordfilm=lordfilm,
-                                     zona=zona)
+        if film.id is not None:
+            await db.save_poster_url(film.id, film.poster)
+        return await conditional_page("result.html", card=card)
     else:
-        return await render_template("result.html", film=None)
+        return await conditional_page("result.html", card=None)
+
+@app.get("/api/search")
+@login_required
+async def search_suggestions():
+    query = request.args.get("query", "")
+    limit = min(request.args.get("limit", SUGGEST_LIMIT, type=int), SUGGEST_LIMIT)
+    films = await utils.search_films(query, max(limit, 1))
+    return {"query": query, "results": [dataclasses.asdict(film) for film in films]}
+
+@app.get("/poster/<int:film_id>")
+async def film_poster(film_id: int):
+    path = await utils.poster_file(film_id)
+    # The placeholder is served for films without a poster; it should not stick in browser caches.
+    max_age = POSTER_MAX_AGE if path != utils.NO_POSTER_PATH else 60 * 60
+    return await send_file(path, cache_timeout=max_age, conditional=True)
 
 @app.route("/add_watch_later/<name>/<int:year>")
 @login_required
@@ -102,17 +238,49 @@ async def delete_watch_later(film_id: int):
     await db.delete_watch_later_film(user_id, film_id)
     return redirect(url_for("watch_later"))
 
+@app.post("/add_watch_later")
+@login_required
+async def add_watch_later_batch():
+    user_id = int(current_user.auth_id)
+    films = []
+    for value in (await request.form).getlist("film"):
+        year, _, name = value.partition(":")
+        if not year.isdigit() or not name:
+            return Response("Неверный фильм", status=400)
+        films.append((name, int(year)))
+    await db.add_watch_later_batch(user_id, films)
+    return redirect(url_for("watch_later"))
+
+@app.post("/delete_watch_later")
+@login_required
+async def delete_watch_later_batch():
+    user_id = int(current_user.auth_id)
+    try:
+        film_ids = [int(film_id) for film_id in (await request.form).getlist("film_id")]
+    except ValueError:
+        return Response("Неверный фильм", status=400)
+    await db.delete_watch_later_batch(user_id, film_ids)
+    return redirect(url_for("watch_later"))
+
 @app.route("/history")
 @login_required
 async def history():
     user_id = int(current_user.auth_id)
-    records = await db.get_history(user_id)
-    return await render_template("history.html", history=records)
+    before = request.args.get("before")
+    try:
+        records, cursor = await db.get_history_page(user_id, before)
+    except ValueError:
+        return Response("Неверный курсор", status=400)
+    last_modified = None
+    if records and before is None:
+        last_modified = datetime.datetime.fromisoformat(records[0]["request_time"]).astimezone(datetime.timezone.utc)
+    return await conditional_page("history.html", last_modified=last_modified, history=records, cursor=cursor)
 
 @app.route("/watch_later")
 @login_required
 async def watch_later():
     user_id = int(current_user.auth_id)
-    films = await db.get_watch_later_films(user_id)
-    return await render_template("watch_later.html", films=films)
+    after = request.args.get("after", type=int)
+    films, cursor = await db.get_watch_later_page(user_id, after)
+    return await conditional_page("watch_later.html", films=films, cursor=cursor)
 
@@ -0,0 +1,145 @@
+import asyncio
+import hmac
+import logging
+import multiprocessing
+import secrets
+import signal
+import typing as tp
+
+from aiohttp import web
+
+import logs
+import metrics
+from config import WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, BOT_WORKERS, METRICS_HOST, METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+# Updates are routed to workers by user, so one user's updates are always
+# handled by the same process and never overtake each other.
+UpdateQueue = multiprocessing.Queue
+
+
+def update_owner(update: dict[str, tp.Any]) -> int:
+    """Return the id that orders an update: its sender, else its chat, else the update itself."""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        if isinstance(value.get("from"), dict):
+            return value["from"]["id"]
+        if isinstance(value.get("chat"), dict):
+            return value["chat"]["id"]
+        if isinstance(value.get("user"), dict):
+            return value["user"]["id"]
+    return update.get("update_id", 0)
+
+
+# ---------WORKER----------
+async def _serve_updates(updates: UpdateQueue, workers: int, index: int) -> None:
+    import telegram_bot
+
+    # Flood limits are per bot, so the global animation budget is split between workers.
+    telegram_bot.animations.global_rate /= workers
+    loop = asyncio.get_running_loop()
+    user_locks: dict[int, asyncio.Lock] = {}
+    user_pending: dict[int, int] = {}
+    tasks: set[asyncio.Task] = set()
+
+    async def process(owner: int, update: dict[str, tp.Any]) -> None:
+        try:
+            # asyncio.Lock is FIFO, so updates of one user run in arrival order. The lock is taken
+            # by telegram_bot.order_user_updates once the handler is known: searches skip it and
+            # are ordered by the search scheduler instead, which merges and supersedes them.
+            await telegram_bot.dp.feed_raw_update(telegram_bot.bot, update, user_lock=user_locks[owner])
+        except Exception as e:
+            logger.error("Ошибка при обработке обновления %s: %s", update.get("update_id"), e)
+        finally:
+            user_pending[owner] -= 1
+            if not user_pending[owner]:
+                del user_pending[owner], user_locks[owner]
+
+    # Only the first worker archives history, so the workers do not repeat each other's work.
+    await telegram_bot.on_startup(metrics_port=METRICS_PORT + 1 + index if METRICS_PORT else 0, archive=index == 0)
+    try:
+        while (update := await loop.run_in_executor(None, updates.get)) is not None:
+            owner = update_owner(update)
+            user_locks.setdefault(owner, asyncio.Lock())
+            user_pending[owner] = user_pending.get(owner, 0) + 1
+            task = asyncio.create_task(process(owner, update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+    finally:
+        await telegram_bot.on_shutdown()
+        await telegram_bot.bot.session.close()
+
+
+def run_worker(updates: UpdateQueue, workers: int, index: int) -> None:
+    """Entry point of a worker process."""
+    # The front process stops workers through their queues.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logs.setup_logging()
+    asyncio.run(_serve_updates(updates, workers, index))
+
+
+# ---------FRONT----------
+# Metrics of the front process only, served on METRICS_HOST:METRICS_PORT rather than the public webhook port;
+# each worker exposes its own on METRICS_PORT + 1 + worker index.
+updates_received = metrics.Counter("webhook_updates_total", "Updates accepted by the webhook, by worker.")
+
+
+def create_app(workers: int = BOT_WORKERS) -> web.Application:
+    """Build the webhook application that fans updates out to worker processes."""
+    context = multiprocessing.get_context("spawn")
+    queues = [context.Queue() for _ in range(workers)]
+    processes = [
+        context.Process(target=run_worker, args=(queue, workers, i), name=f"bot-worker-{i}", daemon=True)
+        for i, queue in enumerate(queues)
+    ]
+    metrics_runners: list[web.AppRunner] = []
+    # Without a secret anyone could post forged updates; the webhook is registered anew on
+    # every start, so a generated secret is handed to Telegram along with it.
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), secret):
+            return web.Response(status=401)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        if not isinstance(update, dict):
+            return web.Response(status=400)
+        worker = update_owner(update) % workers
+        queues[worker].put_nowait(update)
+        updates_received.inc(worker=worker)
+        return web.Response()
+
+    async def on_startup(_: web.Application) -> None:
+        import telegram_bot
+
+        if METRICS_PORT:
+            metrics_runners.append(await metrics.serve(METRICS_HOST, METRICS_PORT))
+        for process in processes:
+            process.start()
+        await telegram_bot.set_default_commands()
+        await telegram_bot.bot.set_webhook(
+            f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+            secret_token=secret,
+            allowed_updates=telegram_bot.dp.resolve_used_update_types(),
+        )
+        await telegram_bot.bot.session.close()
+
+    async def on_cleanup(_: web.Application) -> None:
+        for runner in metrics_runners:
+            await runner.cleanup()
+        for queue in queues:
+            queue.put(None)
+        loop = asyncio.get_running_loop()
+        for process in processes:
+            await loop.run_in_executor(None, process.join, 30)
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app